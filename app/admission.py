@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import math
+import os
+import threading
+from typing import Optional
+
+# Priority classes, most urgent first. Each class gets its own worker pool.
+PRIORITIES: tuple[str, ...] = ("high", "normal", "low")
+DEFAULT_PRIORITY = "normal"
+
+
+def worker_counts() -> dict[str, int]:
+    """Worker pool size per priority class (SCHEDULER_WORKERS_<CLASS>)."""
+    defaults = {"high": 5, "normal": 10, "low": 2}
+    return {p: int(os.getenv(f"SCHEDULER_WORKERS_{p.upper()}", str(defaults[p]))) for p in PRIORITIES}
+
+
+class AdmissionController:
+    """Tracks the due-queue depth and decides whether new immediate tasks are admitted.
+
+    Depth is the number of task runs handed to a worker pool but not yet
+    started. Each priority class has its own limit on the total depth; a limit
+    of 0 means the class is always admitted. Retry-After is estimated from the
+    observed run duration and the pool sizes.
+
+    Args:
+        limits: Maximum total depth at which each class is still admitted.
+        workers: Worker pool size per class.
+    """
+
+    def __init__(self, limits: dict[str, int], workers: dict[str, int]) -> None:
+        self.limits = limits
+        self.workers = workers
+        self._depth: dict[str, int] = {p: 0 for p in PRIORITIES}
+        self._avg_duration = 1.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Build a controller from ADMISSION_MAX_DUE[_<CLASS>] environment variables.
+
+        Defaults: 'low' is refused above 500 queued runs, 'normal' above 1000,
+        and 'high' is never refused.
+        """
+        normal = int(os.getenv("ADMISSION_MAX_DUE", "1000"))
+        limits = {
+            "high": int(os.getenv("ADMISSION_MAX_DUE_HIGH", "0")),
+            "normal": normal,
+            "low": int(os.getenv("ADMISSION_MAX_DUE_LOW", str(normal // 2))),
+        }
+        return cls(limits, worker_counts())
+
+    def depth(self, priority: Optional[str] = None) -> int:
+        """Queued runs for one class, or in total."""
+        with self._lock:
+            return self._depth[priority] if priority else sum(self._depth.values())
+
+    def submitted(self, priority: str) -> None:
+        """Record a run handed to a worker pool."""
+        with self._lock:
+            self._depth[priority] += 1
+
+    def started(self, priority: str) -> None:
+        """Record a queued run starting on a worker."""
+        with self._lock:
+            self._depth[priority] = max(0, self._depth[priority] - 1)
+
+    def finished(self, duration: float) -> None:
+        """Feed a run's duration (seconds) into the Retry-After estimate."""
+        with self._lock:
+            self._avg_duration = 0.9 * self._avg_duration + 0.1 * duration
+
+    def retry_after(self, priority: str) -> Optional[int]:
+        """Return None to admit, or the suggested Retry-After in seconds to refuse.
+
+        Args:
+            priority: Priority class of the new task.
+        """
+        limit = self.limits.get(priority, 0)
+        with self._lock:
+            total = sum(self._depth.values())
+            if not limit or total < limit:
+                return None
+            drain = total * self._avg_duration / max(1, sum(self.workers.values()))
+        return min(300, max(1, math.ceil(drain)))
+
+
+admission = AdmissionController.from_env()
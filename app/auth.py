@@ -4,7 +4,6 @@ import functools
 from datetime import datetime, timezone
 from typing import Annotated, Any, Dict, Optional
 
-import jwt
 from fastapi import Depends, HTTPException, Request, status
 from pydantic import BaseModel
 
@@ -84,6 +83,8 @@ def require_auth(required_scopes: Optional[list[str]] = None):
 
 
     def _dep(request: Request, settings: Annotated[AuthSettings, Depends(get_auth_settings)]) -> Principal:
+        import jwt  # deferred: only needed once auth is enabled on a route
+
         token = _extract_bearer_token(request)
         try:
             # For HS256 shared-secret verification
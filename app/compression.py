@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import gzip
+from typing import Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:  # optional: `poetry install -E speedups`
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:  # optional: `poetry install -E speedups`
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSIBLE_TYPES: tuple[str, ...] = ("application/json", "text/")
+
+
+def available_encodings(gzip_level: int = 6, brotli_quality: int = 4, zstd_level: int = 3) -> dict[str, Callable[[bytes], bytes]]:
+    """Return the supported content codings, in server preference order.
+
+    Args:
+        gzip_level: gzip compression level (1-9).
+        brotli_quality: Brotli quality (0-11), used if `brotli` is installed.
+        zstd_level: Zstandard level, used if `zstandard` is installed.
+
+    Returns:
+        dict: Mapping of coding name to compress function.
+    """
+    encoders: dict[str, Callable[[bytes], bytes]] = {}
+    if zstandard is not None:
+        encoders["zstd"] = zstandard.ZstdCompressor(level=zstd_level).compress
+    if brotli is not None:
+        encoders["br"] = lambda body: brotli.compress(body, quality=brotli_quality)
+    encoders["gzip"] = lambda body: gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return encoders
+
+
+def negotiate(accept_encoding: str, supported: list[str]) -> Optional[str]:
+    """Pick the preferred supported coding acceptable to the client.
+
+    Client q-values win; ties are broken by the server order in `supported`.
+
+    Args:
+        accept_encoding: Raw Accept-Encoding header.
+        supported: Codings the server can produce, most preferred first.
+
+    Returns:
+        Optional[str]: The selected coding, or None to send the identity encoding.
+    """
+    qualities: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[name] = q
+
+    best: Optional[str] = None
+    best_q = 0.0
+    for coding in supported:
+        q = qualities.get(coding, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with zstd, Brotli or gzip.
+
+    Responses smaller than `minimum_size`, already encoded, streamed, or with a
+    non-text content type are passed through. Strong ETags are weakened on
+    compressed responses, since the bytes differ per coding.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, **levels: int) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encoders = available_encodings(**levels)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        coding = negotiate(Headers(scope=scope).get("accept-encoding", ""), list(self.encoders))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        passthrough = False
+
+        async def _send(message: Message) -> None:
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            if passthrough:
+                await send(message)
+                return
+
+            body: bytes = message.get("body", b"")
+            headers = MutableHeaders(raw=start["headers"])
+            content_type = headers.get("content-type", "")
+            compressible = content_type.startswith(COMPRESSIBLE_TYPES) and "content-encoding" not in headers
+
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            if not compressible or message.get("more_body", False) or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = self.encoders[coding](body)
+            headers["Content-Encoding"] = coding
+            headers["Content-Length"] = str(len(compressed))
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = f"W/{etag}"
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, _send)
@@ -1,40 +1,57 @@
 from __future__ import annotations
 
-from typing import Iterable, Optional
+import uuid
+from datetime import datetime
+from typing import Any, Iterable, Optional
 
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.engine import Connection, Row
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 
-from . import models
+from . import deltas, models, task_cache
+from .schemas import lines_to_mask, masks_containing
 
 
-def create_task(db: Session, *, schedule_time, lines: str) -> models.Task:
+def create_task(db: Session, *, schedule_time, lines: str, priority: str = "normal") -> models.Task:
     """Create and persist a new task.
 
     Args:
         db: SQLAlchemy session.
         schedule_time: Datetime when the task should run.
-        lines: Comma-separated tube line IDs.
+        lines: Comma-separated tube line IDs (canonical form).
+        priority: Priority class ('high', 'normal' or 'low').
 
     Returns:
         Task: The newly created task.
     """
-    task = models.Task(schedule_time=schedule_time, lines=lines, status="scheduled")
+    task = models.Task(
+        schedule_time=schedule_time,
+        lines=lines,
+        lines_mask=lines_to_mask(lines),
+        priority=priority,
+        status="scheduled",
+    )
     db.add(task)
     db.commit()
     db.refresh(task)
     return task
 
 
-def get_tasks(db: Session) -> list[models.Task]:
-    """Return all tasks.
+def get_tasks(db: Session, lines_mask: Optional[int] = None) -> list[models.Task]:
+    """Return all tasks, optionally only those covering the given lines.
 
     Args:
         db: SQLAlchemy session.
+        lines_mask: If set, only tasks whose lines include all of these lines.
 
     Returns:
         list[Task]: List of tasks.
     """
-    return list(db.query(models.Task).all())
+    query = db.query(models.Task)
+    if lines_mask:
+        query = query.filter(models.Task.lines_mask.in_(masks_containing(lines_mask)))
+    return materialize_results(db, query.all())
 
 
 def get_task(db: Session, task_id: int) -> Optional[models.Task]:
@@ -47,7 +64,48 @@ def get_task(db: Session, task_id: int) -> Optional[models.Task]:
     Returns:
         Optional[Task]: The task if found, else None.
     """
-    return db.query(models.Task).filter(models.Task.id == task_id).first()
+    task = db.query(models.Task).filter(models.Task.id == task_id).first()
+    if task is not None:
+        materialize_results(db, [task])
+    return task
+
+
+def get_task_meta(db: Session, task_id: int) -> Optional[Row]:
+    """Fetch a task's cache validators without loading its result.
+
+    Args:
+        db: SQLAlchemy session.
+        task_id: The task primary key.
+
+    Returns:
+        Optional[Row]: Row of (id, status, version, updated_at) if found, else None.
+    """
+    return (
+        db.query(models.Task.id, models.Task.status, models.Task.version, models.Task.updated_at)
+        .filter(models.Task.id == task_id)
+        .first()
+    )
+
+
+def get_tasks_meta(db: Session, lines_mask: Optional[int] = None) -> Row:
+    """Return aggregates over the tasks `get_tasks` would list, used to validate the list.
+
+    Args:
+        db: SQLAlchemy session.
+        lines_mask: If set, only tasks whose lines include all of these lines.
+
+    Returns:
+        Row: (count, id_sum, version_sum, last_updated) for the selected tasks.
+    """
+    query = db.query(
+        func.count(models.Task.id),
+        func.coalesce(func.sum(models.Task.id), 0),
+        func.coalesce(func.sum(models.Task.version), 0),
+        func.max(models.Task.updated_at),
+    )
+    if lines_mask:
+        query = query.filter(models.Task.lines_mask.in_(masks_containing(lines_mask)))
+    return query.one()
 
 
 def update_task(
@@ -56,14 +114,16 @@ def update_task(
     *,
     schedule_time=None,
     lines: Optional[str] = None,
+    priority: Optional[str] = None,
 ) -> models.Task:
-    """Update an existing task's schedule time and/or lines.
+    """Update an existing task's schedule time, lines and/or priority.
 
     Args:
         db: SQLAlchemy session.
         task: Target task instance to update.
         schedule_time: Optional new schedule datetime.
         lines: Optional new comma-separated tube line IDs.
+        priority: Optional new priority class.
 
     Returns:
         Task: The updated task instance.
@@ -72,17 +132,319 @@ def update_task(
         task.schedule_time = schedule_time
     if lines is not None:
         task.lines = lines
+        task.lines_mask = lines_to_mask(lines)
+    if priority is not None:
+        task.priority = priority
     db.commit()
+    task_cache.invalidate_tasks([task.id])
     db.refresh(task)
     return task
 
 
+def claim_task(db: Session, task_id: int, *, lease_until: Optional[datetime] = None) -> Optional[str]:
+    """Atomically move a task from 'scheduled' to 'running'.
+
+    Only one caller can win the claim, so a task scheduled in several processes
+    runs once.
+
+    Args:
+        db: SQLAlchemy session.
+        task_id: The task primary key.
+        lease_until: When the claim expires unless renewed (see `renew_leases`).
+
+    Returns:
+        Optional[str]: The claim token to pass to `finish_task`, or None if the
+        task was not claimed.
+    """
+    token = uuid.uuid4().hex
+    claimed = db.execute(
+        update(models.Task)
+        .where(models.Task.id == task_id, models.Task.status == "scheduled")
+        .values(status="running", lease_until=lease_until, claim_token=token)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if not claimed:
+        return None
+    task_cache.invalidate_tasks([task_id])
+    return token
+
+
+def finish_task(db: Session, task_id: int, claim_token: str, status: str, **values: Any) -> bool:
+    """Write the final status of a run, if the task is still held by its claim.
+
+    A run that was handed back by `drain` or reset by the orphan sweeper may
+    have been claimed again; its late result is then dropped instead of
+    overwriting the new run.
+
+    Args:
+        db: SQLAlchemy session.
+        task_id: The task primary key.
+        claim_token: Token returned by `claim_task`.
+        status: Final status ('completed' or 'failed').
+        **values: Other task columns to write (e.g. result).
+
+    Returns:
+        bool: True if the write landed, False if the claim was lost.
+    """
+    t = models.Task
+    written = db.execute(
+        update(t)
+        .where(t.id == task_id, t.status == "running", t.claim_token == claim_token)
+        .values(status=status, lease_until=None, claim_token=None, **values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    if written:
+        task_cache.invalidate_tasks([task_id])
+    return written == 1
+
+
+def renew_leases(db: Session, task_ids: Iterable[int], *, lease_until: datetime) -> int:
+    """Extend the lease of 'running' tasks claimed by this process.
+
+    The row's version and updated_at are left alone, so renewals do not change
+    its ETag or Last-Modified.
+
+    Args:
+        db: SQLAlchemy session.
+        task_ids: Task primary keys.
+        lease_until: New lease expiry.
+
+    Returns:
+        int: Number of leases renewed.
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return 0
+    t = models.Task
+    renewed = db.execute(
+        update(t)
+        .where(t.id.in_(task_ids), t.status == "running")
+        .values(lease_until=lease_until, version=t.version, updated_at=t.updated_at)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return renewed
+
+
+def release_tasks(db: Session, task_ids: Iterable[int]) -> int:
+    """Hand 'running' tasks back to 'scheduled' so another process can run them.
+
+    Args:
+        db: SQLAlchemy session.
+        task_ids: Task primary keys.
+
+    Returns:
+        int: Number of tasks released.
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return 0
+    released = db.execute(
+        update(models.Task)
+        .where(models.Task.id.in_(task_ids), models.Task.status == "running")
+        .values(status="scheduled", lease_until=None, claim_token=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    task_cache.invalidate_tasks(task_ids)
+    return released
+
+
+def reset_orphaned_tasks(db: Session, *, now: datetime, stale_before: datetime) -> list[int]:
+    """Reset tasks left 'running' by a dead process back to 'scheduled'.
+
+    A task is orphaned when its lease expired before `now`. Tasks claimed
+    without a lease (before leases existed) count as orphaned when not touched
+    since `stale_before`.
+
+    Args:
+        db: SQLAlchemy session.
+        now: Current time.
+        stale_before: Cut-off for 'running' tasks without a lease.
+
+    Returns:
+        list[int]: IDs of the tasks reset.
+    """
+    t = models.Task
+    orphaned = and_(
+        t.status == "running",
+        or_(
+            t.lease_until < now,
+            and_(t.lease_until.is_(None), or_(t.updated_at.is_(None), t.updated_at < stale_before)),
+        ),
+    )
+    ids = list(db.scalars(select(t.id).where(orphaned)))
+    if not ids:
+        return []
+    db.execute(
+        update(t)
+        .where(t.id.in_(ids), orphaned)
+        .values(status="scheduled", lease_until=None, claim_token=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    task_cache.invalidate_tasks(ids)
+    return ids
+
+
+def get_scheduled_tasks(db: Session, *, due_before: Optional[datetime] = None) -> list[Row]:
+    """Return (id, schedule_time, priority) for tasks still waiting to run.
+
+    Args:
+        db: SQLAlchemy session.
+        due_before: If set, only tasks whose schedule_time is before this.
+
+    Returns:
+        list[Row]: Lightweight rows usable with `schedule_task`.
+    """
+    query = db.query(models.Task.id, models.Task.schedule_time, models.Task.priority).filter(
+        models.Task.status == "scheduled"
+    )
+    if due_before is not None:
+        query = query.filter(models.Task.schedule_time < due_before)
+    return query.all()
+
+
+def materialize_results(db: Session, tasks: Iterable[models.Task]) -> list[models.Task]:
+    """Replace delta/same-encoded results with the full payload, in memory only.
+
+    The loaded value is set as committed state, so it is never written back.
+
+    Args:
+        db: SQLAlchemy session.
+        tasks: Tasks as loaded from the database.
+
+    Returns:
+        list[Task]: The same tasks, with full results.
+    """
+    tasks = list(tasks)
+    for task in tasks:
+        if task.result_kind in (deltas.DELTA, deltas.SAME) and not getattr(task, "_result_materialized", False):
+            set_committed_value(task, "result", deltas.materialize(db, task))
+            task._result_materialized = True
+    return tasks
+
+
+def changes_cursor(task: models.Task) -> str:
+    """Return the changes-feed cursor positioned just after `task`."""
+    return f"{task.changed_at.isoformat()}_{task.id}"
+
+
+def parse_changes_cursor(cursor: str) -> tuple[datetime, int]:
+    """Parse a cursor returned by `changes_cursor`.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    stamp, _, task_id = cursor.rpartition("_")
+    return datetime.fromisoformat(stamp), int(task_id)
+
+
+def get_changes(
+    db: Session,
+    *,
+    after: Optional[tuple[datetime, int]] = None,
+    settled_before: Optional[datetime] = None,
+    lines_mask: Optional[int] = None,
+    limit: int = 100,
+) -> list[models.Task]:
+    """Return completed tasks whose result changed, in the order the changes were stored.
+
+    The feed is ordered by (changed_at, id), which only grows as results are
+    stored, so a task scheduled earlier but completed later is still returned
+    after the cursor.
+
+    Args:
+        db: SQLAlchemy session.
+        after: Feed cursor (changed_at, id); only changes after it.
+        settled_before: Only changes stored before this, so writes still being
+            committed cannot land behind the cursor.
+        lines_mask: If set, only tasks whose lines include all of these lines.
+        limit: Maximum number of tasks.
+
+    Returns:
+        list[Task]: Changed tasks with full results.
+    """
+    t = models.Task
+    query = db.query(t).filter(t.changed.is_(True), t.changed_at.is_not(None))
+    if after is not None:
+        changed_at, task_id = after
+        query = query.filter(or_(t.changed_at > changed_at, and_(t.changed_at == changed_at, t.id > task_id)))
+    if settled_before is not None:
+        query = query.filter(t.changed_at < settled_before)
+    if lines_mask:
+        query = query.filter(t.lines_mask.in_(masks_containing(lines_mask)))
+    return materialize_results(db, query.order_by(t.changed_at, t.id).limit(limit).all())
+
+
+def detach_dependants(db: Session | Connection, base_ids: list[int]) -> int:
+    """Store full results on tasks whose delta/same result refers to `base_ids`.
+
+    Must run before a snapshot task is deleted or its result cleared. Does not commit.
+
+    Args:
+        db: SQLAlchemy session (or connection).
+        base_ids: Snapshot task IDs about to disappear.
+
+    Returns:
+        int: Number of tasks rewritten.
+    """
+    if not base_ids:
+        return 0
+    t = models.Task
+    # Core statements: ORM instances may hold in-memory materialized results.
+    dependants = db.execute(
+        select(t.id, t.result, t.result_kind, t.result_base_id).where(t.result_base_id.in_(base_ids))
+    ).all()
+    if not dependants:
+        return 0
+    bases = dict(db.execute(select(t.id, t.result).where(t.id.in_(base_ids))).all())
+    for row in dependants:
+        full = deltas.resolve(row.result_kind, row.result, bases.get(row.result_base_id))
+        db.execute(
+            update(t)
+            .where(t.id == row.id)
+            .values(result=full, result_kind=deltas.FULL, result_base_id=None)
+            .execution_options(synchronize_session=False)
+        )
+    return len(dependants)
+
+
+def backfill_lines_masks(db: Session, batch_size: int = 500) -> int:
+    """Populate `lines_mask` for rows created before the column existed.
+
+    Args:
+        db: SQLAlchemy session.
+        batch_size: Rows updated per commit.
+
+    Returns:
+        int: Number of rows updated.
+    """
+    updated = 0
+    while True:
+        batch = db.query(models.Task).filter(models.Task.lines_mask.is_(None)).limit(batch_size).all()
+        if not batch:
+            return updated
+        for task in batch:
+            try:
+                task.lines_mask = lines_to_mask(task.lines)
+            except ValueError:
+                task.lines_mask = 0
+        db.commit()
+        updated += len(batch)
+
+
 def delete_task(db: Session, task: models.Task) -> None:
-    """Delete a task.
+    """Delete a task, first giving any results diffed against it their full payload.
 
     Args:
         db: SQLAlchemy session.
         task: Task instance to delete.
     """
+    task_id = task.id
+    detach_dependants(db, [task_id])
     db.delete(task)
     db.commit()
+    task_cache.invalidate_tasks([task_id])
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from typing import Any, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+# Result storage kinds. Rows written before delta mode have kind None (full).
+FULL = "full"
+DELTA = "delta"
+SAME = "same"
+
+# Store a delta only if it is at most this fraction of the full payload.
+MAX_DELTA_RATIO = float(os.getenv("RESULT_DELTA_MAX_RATIO", "0.5"))
+
+
+def delta_mode_enabled() -> bool:
+    """Return True if results should be stored as diffs (RESULT_DELTA_MODE=1)."""
+    return os.getenv("RESULT_DELTA_MODE") == "1"
+
+
+@dataclass(frozen=True)
+class EncodedResult:
+    """How a new result is stored relative to the previous one for the same lines.
+
+    Attributes:
+        kind: FULL, DELTA or SAME.
+        result: Stored text: the payload (FULL), a JSON diff (DELTA) or None (SAME).
+        base_id: Snapshot task the DELTA/SAME result refers to.
+        changed: Whether the content differs from the previous result.
+    """
+
+    kind: str
+    result: Optional[str]
+    base_id: Optional[int]
+    changed: bool
+
+
+def _key(item: Any) -> str:
+    return json.dumps(item, sort_keys=True, separators=(",", ":"))
+
+
+def diff(base: list[Any], new: list[Any]) -> list[Any]:
+    """Return ops turning `base` into `new`.
+
+    Each op is either `[i, j]` (copy base[i:j]) or `{"+": [...]}` (insert items).
+    """
+    matcher = SequenceMatcher(a=[_key(x) for x in base], b=[_key(x) for x in new], autojunk=False)
+    ops: list[Any] = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("insert", "replace"):
+            ops.append({"+": new[j1:j2]})
+    return ops
+
+
+def apply(base: list[Any], ops: list[Any]) -> list[Any]:
+    """Rebuild a list from its base and the ops produced by `diff`."""
+    out: list[Any] = []
+    for op in ops:
+        if isinstance(op, dict):
+            out.extend(op["+"])
+        else:
+            out.extend(base[op[0] : op[1]])
+    return out
+
+
+def _snapshot(db: Session, task_id: int) -> Optional[models.Task]:
+    return db.get(models.Task, task_id)
+
+
+def resolve(kind: Optional[str], stored: Optional[str], base_result: Optional[str]) -> Optional[str]:
+    """Return the full result text from a stored value and its snapshot's result."""
+    if kind not in (DELTA, SAME):
+        return stored
+    if base_result is None:
+        return None
+    if kind == SAME:
+        return base_result
+    return json.dumps(apply(json.loads(base_result), json.loads(stored)), ensure_ascii=False)
+
+
+def materialize(db: Session, task: models.Task) -> Optional[str]:
+    """Return the full result text for a task, resolving DELTA/SAME storage."""
+    if getattr(task, "_result_materialized", False):
+        return task.result
+    if task.result_kind not in (DELTA, SAME) or task.result_base_id is None:
+        return task.result
+    base = _snapshot(db, task.result_base_id)
+    return resolve(task.result_kind, task.result, base.result if base is not None else None)
+
+
+def _previous(db: Session, task: models.Task) -> Optional[models.Task]:
+    """Most recently stored completed result for the same line set, other than `task`.
+
+    Tasks complete in `schedule_time` order, not id order, so this orders by
+    when results were stored; rows stored before delta mode fall back to id.
+    """
+    return (
+        db.query(models.Task)
+        .filter(
+            models.Task.lines_mask == task.lines_mask,
+            models.Task.status == "completed",
+            models.Task.id != task.id,
+        )
+        .order_by(models.Task.changed_at.desc().nulls_last(), models.Task.id.desc())
+        .first()
+    )
+
+
+def encode(db: Session, task: models.Task, payload: str) -> EncodedResult:
+    """Decide how to store `payload` for `task` given the previous result for its lines.
+
+    Identical content becomes SAME (no payload stored). Otherwise a diff against
+    the previous snapshot is stored if it is small enough, else the full payload.
+
+    Args:
+        db: SQLAlchemy session.
+        task: The task being completed.
+        payload: Raw result text returned by TfL.
+
+    Returns:
+        EncodedResult: What to write to the task row.
+    """
+    previous = _previous(db, task)
+    if previous is None:
+        return EncodedResult(FULL, payload, None, True)
+
+    snapshot = previous
+    if previous.result_kind in (DELTA, SAME) and previous.result_base_id is not None:
+        snapshot = _snapshot(db, previous.result_base_id)
+    if snapshot is None or snapshot.result is None:
+        return EncodedResult(FULL, payload, None, True)
+
+    previous_text = materialize(db, previous)
+    try:
+        new_items = json.loads(payload)
+        changed = previous_text is None or new_items != json.loads(previous_text)
+        base_items = json.loads(snapshot.result)
+    except ValueError:
+        return EncodedResult(FULL, payload, None, payload != previous_text)
+
+    if not changed:
+        return EncodedResult(SAME, None, snapshot.id, False)
+    if not isinstance(new_items, list) or not isinstance(base_items, list):
+        return EncodedResult(FULL, payload, None, True)
+
+    ops = json.dumps(diff(base_items, new_items), ensure_ascii=False, separators=(",", ":"))
+    if len(ops) <= MAX_DELTA_RATIO * len(payload):
+        return EncodedResult(DELTA, ops, snapshot.id, True)
+    return EncodedResult(FULL, payload, None, True)
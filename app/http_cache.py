@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Iterable, Optional
+
+from fastapi import Request, Response, status
+
+# Terminal tasks never change again (only deletion), so clients may keep them.
+TERMINAL_STATUSES: frozenset[str] = frozenset({"completed", "failed"})
+TERMINAL_CACHE_CONTROL = "private, max-age=86400, immutable"
+MUTABLE_CACHE_CONTROL = "private, no-cache"
+
+
+def task_etag(task_id: int, version: int, variant: str = "") -> str:
+    """Return the strong ETag for a single task representation.
+
+    `variant` distinguishes alternative representations (e.g. raw results).
+    """
+    suffix = f"-{variant}" if variant else ""
+    return f'"task-{task_id}-v{version}{suffix}"'
+
+
+def list_etag(
+    count: int, id_sum: int, version_sum: int, last_updated: Optional[datetime], variant: str = ""
+) -> str:
+    """Return the strong ETag for the task list, derived from table aggregates.
+
+    Any insert, delete or update changes at least one of the inputs.
+    """
+    stamp = last_updated.isoformat() if last_updated else ""
+    digest = hashlib.blake2b(f"{count}:{id_sum}:{version_sum}:{stamp}:{variant}".encode(), digest_size=12)
+    return f'"tasks-{digest.hexdigest()}"'
+
+
+def rows_list_etag(tasks: Iterable[Any], variant: str = "") -> str:
+    """Return the list ETag computed from already loaded tasks.
+
+    Equal to `list_etag` over the aggregates of the same rows, so a list served
+    without the aggregate query still validates against it later.
+    """
+    count = id_sum = version_sum = 0
+    last_updated: Optional[datetime] = None
+    for task in tasks:
+        count += 1
+        id_sum += task.id
+        version_sum += task.version
+        if task.updated_at is not None and (last_updated is None or task.updated_at > last_updated):
+            last_updated = task.updated_at
+    return list_etag(count, id_sum, version_sum, last_updated, variant)
+
+
+def http_date(value: datetime) -> str:
+    """Format a (naive local or aware) datetime as an RFC 7231 HTTP-date."""
+    return format_datetime(value.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def is_conditional(request: Request) -> bool:
+    """True if the request carries If-None-Match or If-Modified-Since."""
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against the current representation.
+
+    If-None-Match takes precedence when both are present (RFC 7232 §6).
+    """
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_matches(inm, etag)
+
+    ims = request.headers.get("if-modified-since")
+    if ims and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        # Safe at 1-second resolution: cache_headers never hands out the date of
+        # a second in which the resource could still change.
+        return _whole_second(last_modified) <= since
+    return False
+
+
+def _whole_second(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def cache_headers(
+    etag: str, last_modified: Optional[datetime], terminal: bool, now: Optional[datetime] = None
+) -> dict[str, str]:
+    """Build the validator and Cache-Control headers for a representation.
+
+    HTTP-dates have 1-second resolution, so Last-Modified is only sent once
+    the second of the last change has passed. Otherwise a second change within
+    the same second would carry the same date, and If-Modified-Since would
+    answer 304 for it. Until then clients revalidate with the ETag.
+
+    Args:
+        etag: Current ETag.
+        last_modified: Time of the last change, if known.
+        terminal: The representation will not change again.
+        now: Current time (defaults to now).
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": TERMINAL_CACHE_CONTROL if terminal else MUTABLE_CACHE_CONTROL,
+    }
+    if last_modified is not None and _whole_second(last_modified) < _whole_second(now or datetime.now(timezone.utc)):
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified(headers: dict[str, str]) -> Response:
+    """Return an empty 304 response carrying the given validators."""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
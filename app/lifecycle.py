@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from . import crud
+from .database import SessionLocal
+from .locks import ProcessLock
+from .scheduler import (
+    LEASE_SECONDS,
+    draining,
+    get_scheduler,
+    in_flight,
+    schedule_task,
+    scheduler_running,
+    wheel,
+)
+from .write_buffer import write_buffer
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class DrainReport:
+    """Outcome of a drain.
+
+    Attributes:
+        duration_ms: Time from the start of the drain until it returned.
+        finished: Runs that completed within the deadline.
+        handed_back: Task IDs still running at the deadline, reset to 'scheduled'.
+    """
+
+    duration_ms: float = 0.0
+    finished: int = 0
+    handed_back: list[int] = field(default_factory=list)
+
+
+def drain(deadline: float | None = None) -> DrainReport:
+    """Stop claiming work, let in-flight runs finish, and hand back the rest.
+
+    1. Stop dispatching: pause APScheduler, stop the wheel's ticker, and make
+       `run_task` refuse new claims (their tasks stay 'scheduled').
+    2. Wait up to `deadline` seconds for in-flight runs to finish.
+    3. Reset runs still going at the deadline to 'scheduled', so the next
+       process picks them up, and flush the write-behind buffer.
+
+    Args:
+        deadline: Seconds to wait for in-flight runs (DRAIN_TIMEOUT_SECONDS, default 20).
+
+    Returns:
+        DrainReport: Duration and what happened to in-flight runs.
+    """
+    if deadline is None:
+        deadline = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "20"))
+    started = time.perf_counter()
+    draining.set()
+    if scheduler_running():
+        get_scheduler().pause()
+    if wheel is not None:
+        wheel.shutdown(wait=False)
+
+    running = in_flight()
+    initial = len(running)
+    while running and time.perf_counter() - started < deadline:
+        time.sleep(0.05)
+        running = in_flight()
+
+    report = DrainReport(finished=initial - len(running), handed_back=sorted(running))
+    if report.handed_back:
+        db: Session = SessionLocal()
+        try:
+            crud.release_tasks(db, report.handed_back)
+        finally:
+            db.close()
+    if write_buffer is not None:
+        write_buffer.flush(force=True)
+
+    report.duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    log.info(
+        "drain: done",
+        extra={"duration_ms": report.duration_ms, "finished": report.finished, "handed_back": report.handed_back},
+    )
+    return report
+
+
+def _grace(stale_after: Optional[float]) -> float:
+    return float(os.getenv("ORPHAN_GRACE_SECONDS", "120")) if stale_after is None else stale_after
+
+
+def recover_tasks(stale_after: float | None = None) -> tuple[int, int]:
+    """Reset orphaned 'running' tasks and reschedule every 'scheduled' task.
+
+    Run once by the supervisor leader when it takes over: in-memory job stores
+    are empty after a restart, and a process killed mid-run leaves its task
+    'running' until its lease expires. Rescheduling a task another live process
+    also holds is safe since runs are claimed.
+
+    Args:
+        stale_after: Seconds after which a 'running' task claimed without a lease
+            counts as orphaned (ORPHAN_GRACE_SECONDS, default 120).
+
+    Returns:
+        tuple[int, int]: (tasks reset, tasks scheduled).
+    """
+    now = datetime.now()
+    db: Session = SessionLocal()
+    try:
+        reset = crud.reset_orphaned_tasks(db, now=now, stale_before=now - timedelta(seconds=_grace(stale_after)))
+        pending = crud.get_scheduled_tasks(db)
+    finally:
+        db.close()
+
+    for task in pending:
+        schedule_task(task)
+
+    log.info("recover_tasks: done", extra={"reset": len(reset), "scheduled": len(pending)})
+    return len(reset), len(pending)
+
+
+def sweep_tasks(stale_after: float | None = None) -> tuple[int, int]:
+    """Recover runs whose lease expired and tasks no process has run on time.
+
+    Orphaned 'running' tasks are reset and rescheduled here. 'scheduled' tasks
+    more than `stale_after` seconds overdue (e.g. their job was held by a
+    worker that was killed) are rescheduled too.
+
+    Args:
+        stale_after: Overdue threshold in seconds (ORPHAN_GRACE_SECONDS, default 120).
+
+    Returns:
+        tuple[int, int]: (tasks reset, tasks scheduled).
+    """
+    now = datetime.now()
+    cutoff = now - timedelta(seconds=_grace(stale_after))
+    db: Session = SessionLocal()
+    try:
+        reset = set(crud.reset_orphaned_tasks(db, now=now, stale_before=cutoff))
+        overdue = [
+            task
+            for task in crud.get_scheduled_tasks(db, due_before=now)
+            if task.schedule_time < cutoff or task.id in reset
+        ]
+    finally:
+        db.close()
+
+    for task in overdue:
+        schedule_task(task)
+
+    if reset or overdue:
+        log.info("sweep_tasks: done", extra={"reset": len(reset), "scheduled": len(overdue)})
+    return len(reset), len(overdue)
+
+
+def renew_leases() -> int:
+    """Extend the leases of runs in flight in this process.
+
+    Returns:
+        int: Number of leases renewed.
+    """
+    running = in_flight()
+    if not running:
+        return 0
+    db: Session = SessionLocal()
+    try:
+        return crud.renew_leases(db, running, lease_until=datetime.now() + timedelta(seconds=LEASE_SECONDS))
+    finally:
+        db.close()
+
+
+class TaskSupervisor:
+    """Keeps this process's run leases alive and, in one elected process, recovers tasks.
+
+    Every process renews the leases of its in-flight runs every third of the
+    lease. The process holding the `leader` lock runs `recover_tasks` once when
+    it becomes leader and `sweep_tasks` every `sweep_interval` seconds after,
+    so recovery is not repeated by every gunicorn worker.
+
+    Args:
+        sweep_interval: Seconds between sweeps (ORPHAN_SWEEP_SECONDS, default 30).
+    """
+
+    def __init__(self, sweep_interval: Optional[float] = None) -> None:
+        self.sweep_interval = (
+            float(os.getenv("ORPHAN_SWEEP_SECONDS", "30")) if sweep_interval is None else sweep_interval
+        )
+        self.tick = min(LEASE_SECONDS / 3, self.sweep_interval)
+        self._leading = False
+        self._last_sweep = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> None:
+        """Renew leases and, if this process is (or becomes) the leader, recover or sweep."""
+        try:
+            renew_leases()
+        except Exception:  # noqa: BLE001
+            log.exception("supervisor: lease renewal failed")
+        try:
+            if not leader.try_acquire():
+                self._leading = False
+                return
+            if not self._leading:
+                self._leading = True
+                recover_tasks()
+                self._last_sweep = time.monotonic()
+            elif time.monotonic() - self._last_sweep >= self.sweep_interval:
+                sweep_tasks()
+                self._last_sweep = time.monotonic()
+        except Exception:  # noqa: BLE001
+            log.exception("supervisor: recovery failed")
+
+    def start(self) -> None:
+        """Run one pass now, then keep supervising in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self.run_once()
+        self._thread = threading.Thread(target=self._run, name="task-supervisor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the thread and give up leadership."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        leader.release()
+        self._leading = False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.tick):
+            self.run_once()
+
+
+# Held by the one process that recovers and sweeps tasks (see TaskSupervisor).
+leader = ProcessLock("task-supervisor")
+supervisor = TaskSupervisor()
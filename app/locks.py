@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import IO, Any, Optional
+
+from . import database
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+class ProcessLock:
+    """Exclusive lock shared by every process using the same database.
+
+    On Postgres it is a session-level advisory lock held on a dedicated
+    connection; otherwise (SQLite, one host) an `flock` on a file named after
+    the database URL. The lock is held until `release` or until the process
+    exits, so it can elect one process (e.g. one gunicorn worker) to run
+    periodic jobs.
+
+    Args:
+        name: Lock name; processes using the same name and database exclude each other.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._key = int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+        self._conn: Any = None
+        self._file: Optional[IO[str]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def held(self) -> bool:
+        return self._conn is not None or self._file is not None
+
+    def try_acquire(self) -> bool:
+        """Take the lock if it is free. Returns True while this process holds it."""
+        with self._lock:
+            if self.held and self._still_held():
+                return True
+            engine = database.get_engine()
+            if engine.dialect.name == "postgresql":
+                return self._acquire_advisory(engine)
+            return self._acquire_file()
+
+    def _still_held(self) -> bool:
+        if self._conn is None:
+            return True
+        try:
+            with self._conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception:  # noqa: BLE001
+            # The connection, and with it the advisory lock, is gone.
+            log.warning("locks: lost connection holding lock", extra={"lock": self.name})
+            self._close_conn()
+            return False
+
+    def _acquire_advisory(self, engine) -> bool:
+        raw = engine.raw_connection()
+        try:
+            conn = raw.driver_connection
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (self._key,))
+                acquired = bool(cur.fetchone()[0])
+        except Exception:  # noqa: BLE001
+            raw.invalidate()
+            raise
+        if not acquired:
+            raw.invalidate()
+            return False
+        # Keep the connection out of the pool for as long as the lock is held.
+        raw.detach()
+        self._conn = raw
+        log.info("locks: acquired", extra={"lock": self.name})
+        return True
+
+    def _acquire_file(self) -> bool:
+        if fcntl is None:
+            return True
+        digest = hashlib.blake2b(f"{database.database_url()}:{self.name}".encode(), digest_size=8).hexdigest()
+        fh = open(os.path.join(tempfile.gettempdir(), f"tasks-{self.name}-{digest}.lock"), "w")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return False
+        self._file = fh
+        log.info("locks: acquired", extra={"lock": self.name})
+        return True
+
+    def _close_conn(self) -> None:
+        try:
+            self._conn.close()
+        except Exception:  # noqa: BLE001
+            pass
+        self._conn = None
+
+    def release(self) -> None:
+        """Release the lock if this process holds it."""
+        with self._lock:
+            if self._conn is not None:
+                self._close_conn()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
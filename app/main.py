@@ -3,33 +3,74 @@ from __future__ import annotations
 import os
 from fastapi import FastAPI
 
+from app.compression import CompressionMiddleware
 from app.logging_config import configure_logging
 from app.database import init_db
+from app.lifecycle import drain, supervisor
+from app.responses import FastJSONResponse
+from app.retention import RetentionPolicy, retention_lock, run_retention
 from app.routes import router
-from app.scheduler import scheduler
+from app.scheduler import get_scheduler, scheduler_running, wheel
+from app.task_cache import task_cache
+from app.write_buffer import write_buffer
 
 
 app = FastAPI(
     title="WovenLight TfL Scheduler",
     version="1.0.0",
     description="Schedules TfL Line Disruption queries for specified tube lines.",
+    default_response_class=FastJSONResponse,
 )
 
 configure_logging()
 
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
 app.include_router(router)
 
 
 @app.on_event("startup")
 def on_startup() -> None:
-    """Initialize database and start the background scheduler."""
-    init_db()
+    """Initialize database, recover unfinished tasks and start the background scheduler.
+
+    The schema step is skipped when the gunicorn master already ran it (DB_INIT_DONE=1).
+    """
+    if os.getenv("DB_INIT_DONE") != "1":
+        init_db()
+    if write_buffer is not None:
+        write_buffer.start()
+    if task_cache is not None:
+        task_cache.start()
     if os.getenv("DISABLE_SCHEDULER") != "1":
+        scheduler = get_scheduler()
+        retention = RetentionPolicy.from_env()
+        if retention is not None:
+            scheduler.add_job(
+                run_retention,
+                "interval",
+                args=[retention],
+                minutes=retention.interval_minutes,
+                id="retention",
+                executor="low",
+                replace_existing=True,
+                coalesce=True,
+                max_instances=1,
+            )
+        supervisor.start()
         scheduler.start()
+        if wheel is not None:
+            wheel.start()
 
 
 @app.on_event("shutdown")
 def on_shutdown() -> None:
-    """Gracefully shut down the background scheduler."""
+    """Drain in-flight tasks, shut down the background scheduler, flush buffered writes and stop cache invalidation."""
     if os.getenv("DISABLE_SCHEDULER") != "1":
-        scheduler.shutdown()
\ No newline at end of file
+        drain()
+        supervisor.stop()
+        if scheduler_running():
+            get_scheduler().shutdown(wait=False)
+        retention_lock.release()
+    if write_buffer is not None:
+        write_buffer.stop()
+    if task_cache is not None:
+        task_cache.stop()
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
-from sqlalchemy import Column, DateTime, Integer, String, Text
+from datetime import datetime
+
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, Text, text
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -12,9 +14,23 @@ class Task(Base):
     Attributes:
         id: Auto-incremented primary key.
         schedule_time: The datetime when the task should be executed.
-        lines: Comma-separated TfL tube line IDs to query.
+        lines: Comma-separated TfL tube line IDs to query (canonical, sorted).
+        lines_mask: Bitmask of `lines` (see schemas.LINE_BITS), indexed for line lookups.
         status: Execution status: 'scheduled', 'running', 'completed', or 'failed'.
-        result: Raw JSON string returned by TfL (or error message on failure).
+        priority: Priority class: 'high', 'normal' or 'low' (selects the worker pool).
+        result: Raw JSON string returned by TfL (or error message on failure). In delta
+            mode this holds a diff ('delta') or nothing ('same'); see app.deltas.
+        result_kind: How `result` is stored: 'full' (or None), 'delta' or 'same'.
+        result_base_id: Snapshot task a 'delta'/'same' result refers to.
+        changed: Whether the result differs from the previous one for the same lines.
+        changed_at: When the result was stored in delta mode; orders the changes
+            feed and picks the previous result to diff against.
+        version: Row version, incremented by every UPDATE (used for ETags).
+        updated_at: Time of the last change to the row (used for Last-Modified).
+        lease_until: While 'running', when the claiming process's lease expires; the
+            process renews it while the run is in flight (see app.lifecycle).
+        claim_token: While 'running', identifies the claim; the run's final write
+            only lands if the task is still held by the same claim.
     """
 
     __tablename__ = "tasks"
@@ -22,5 +38,16 @@ class Task(Base):
     id: int = Column(Integer, primary_key=True, index=True)
     schedule_time = Column(DateTime, nullable=False, index=True)
     lines: str = Column(String, nullable=False)
+    lines_mask: int | None = Column(Integer, nullable=True, index=True)
     status: str = Column(String, nullable=False, default="scheduled")
+    priority: str = Column(String, nullable=False, default="normal", server_default="normal")
     result: str | None = Column(Text, nullable=True)
+    result_kind: str | None = Column(String, nullable=True)
+    result_base_id: int | None = Column(Integer, nullable=True, index=True)
+    changed: bool | None = Column(Boolean, nullable=True)
+    changed_at = Column(DateTime, nullable=True, index=True)
+    # SQL-side onupdate so Core/bulk UPDATEs (e.g. the write-behind buffer) bump it too.
+    version: int = Column(Integer, nullable=False, default=1, server_default="1", onupdate=text("version + 1"))
+    updated_at = Column(DateTime, nullable=True, default=datetime.now, onupdate=datetime.now)
+    lease_until = Column(DateTime, nullable=True)
+    claim_token: str | None = Column(String, nullable=True)
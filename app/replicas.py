@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Generator, Optional
+
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+
+from .database import ReadSessionLocal, SessionLocal, replica_url
+
+# Read-your-writes: after a client writes, its reads go to the primary for
+# READ_YOUR_WRITES_SECONDS (longer than the expected replica lag). Clients are
+# tracked with a cookie holding the epoch second the window ends; tasks written
+# in this process (API writes and scheduler runs) are tracked by ID, so polls
+# from other clients also see fresh status for that window.
+STICKY_COOKIE = "primary_until"
+
+_recent_writes: dict[int, float] = {}
+_recent_lock = threading.Lock()
+_MAX_TRACKED = 10_000
+
+
+def sticky_seconds() -> float:
+    """Length of the read-your-writes window (READ_YOUR_WRITES_SECONDS, default 5)."""
+    return float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+
+def mark_written(task_id: int, response: Optional[Response] = None) -> None:
+    """Route reads of `task_id` (and of the client behind `response`) to the primary for a while.
+
+    Args:
+        task_id: Task that was just written.
+        response: If given, the writing client gets the sticky cookie.
+    """
+    if replica_url() is None:
+        return
+    window = sticky_seconds()
+    now = time.monotonic()
+    with _recent_lock:
+        if len(_recent_writes) >= _MAX_TRACKED:
+            for stale in [k for k, until in _recent_writes.items() if until <= now]:
+                del _recent_writes[stale]
+        _recent_writes[task_id] = now + window
+    if response is not None:
+        response.set_cookie(STICKY_COOKIE, str(int(time.time() + window)), max_age=int(window) + 1, httponly=True)
+
+
+def recently_written(task_id: int) -> bool:
+    """Return True while `task_id` is inside its read-your-writes window."""
+    with _recent_lock:
+        until = _recent_writes.get(task_id)
+        if until is None:
+            return False
+        if until > time.monotonic():
+            return True
+        del _recent_writes[task_id]
+        return False
+
+
+def _client_is_sticky(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, "0")) > time.time()
+    except ValueError:
+        return False
+
+
+def reads_from_primary(request: Request) -> bool:
+    """Decide whether a read request must be served by the primary.
+
+    Args:
+        request: Incoming read request; a `task_id` path parameter is honoured.
+
+    Returns:
+        bool: True with no replica configured, for sticky clients and for recently written tasks.
+    """
+    if replica_url() is None or _client_is_sticky(request):
+        return True
+    try:
+        task_id = int(request.path_params["task_id"])
+    except (KeyError, ValueError):
+        return False
+    return recently_written(task_id)
+
+
+def get_read_db(request: Request) -> Generator[Session, None, None]:
+    """Yield a session for read-only queries and ensure it is closed.
+
+    Uses the replica unless read-your-writes requires the primary.
+    """
+    db: Session = SessionLocal() if reads_from_primary(request) else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Literal
+
+from fastapi.responses import JSONResponse
+
+from . import schemas
+
+try:  # optional speedup: `poetry install -E speedups`
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson is not installed
+    orjson = None
+
+ResultFormat = Literal["string", "raw"]
+
+
+class RawJSON:
+    """A value that is already valid JSON text and must be embedded verbatim."""
+
+    __slots__ = ("text",)
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, RawJSON):
+        if hasattr(orjson, "Fragment"):
+            return orjson.Fragment(obj.text)
+        return json.loads(obj.text)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize content to compact JSON bytes, embedding RawJSON values unescaped.
+
+    Uses orjson when installed and falls back to the standard library.
+
+    Args:
+        content: JSON-compatible data, possibly containing RawJSON values.
+
+    Returns:
+        bytes: UTF-8 encoded JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_orjson_default)
+
+    raws: list[str] = []
+
+    def _default(obj: Any) -> Any:
+        if isinstance(obj, RawJSON):
+            raws.append(obj.text)
+            return f"\x00raw{len(raws) - 1}\x00"
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    text = json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default)
+    for i, raw in enumerate(raws):
+        text = text.replace(f'"\\u0000raw{i}\\u0000"', raw, 1)
+    return text.encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with `dumps` (orjson when available, compact separators)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def _is_json(text: str) -> bool:
+    try:
+        (orjson.loads if orjson is not None else json.loads)(text)
+    except ValueError:
+        return False
+    return True
+
+
+def task_payload(task: Any, result_format: ResultFormat = "string") -> dict[str, Any]:
+    """Build the JSON body for a task.
+
+    With result_format="raw", the result of a completed task (the TfL JSON text)
+    is embedded as JSON instead of as an escaped string. Results that are not
+    valid JSON are returned as strings, as with result_format="string".
+
+    Args:
+        task: ORM task (or any object accepted by TaskOut).
+        result_format: "string" (default) or "raw".
+
+    Returns:
+        dict: JSON-compatible payload matching TaskOut.
+    """
+    payload = schemas.TaskOut.model_validate(task).model_dump(mode="json")
+    result = payload["result"]
+    if result_format == "raw" and payload["status"] == "completed" and result is not None and _is_json(result):
+        payload["result"] = RawJSON(result)
+    return payload
@@ -0,0 +1,402 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import IO, Optional
+
+from sqlalchemy import bindparam, delete, exists, or_, select, text, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, aliased
+
+from . import deltas
+from .locks import ProcessLock
+from .crud import detach_dependants, materialize_results
+from .database import SessionLocal, get_engine
+from .models import Task
+from .task_cache import invalidate_all_tasks, invalidate_tasks
+
+log = logging.getLogger(__name__)
+
+TERMINAL_STATUSES: tuple[str, ...] = ("completed", "failed")
+
+# Postgres layout for time-partitioned tasks. `create_all` leaves an existing
+# `tasks` table alone, so create it with this DDL before the first start to let
+# retention drop whole months instead of deleting rows. The primary key has to
+# include the partition key. Keep the columns in step with `models.Task`.
+PARTITIONED_TASKS_DDL = """
+CREATE TABLE tasks (
+    id SERIAL,
+    schedule_time TIMESTAMP NOT NULL,
+    lines VARCHAR NOT NULL,
+    lines_mask INTEGER,
+    status VARCHAR NOT NULL,
+    priority VARCHAR NOT NULL DEFAULT 'normal',
+    result TEXT,
+    result_kind VARCHAR,
+    result_base_id INTEGER,
+    changed BOOLEAN,
+    changed_at TIMESTAMP,
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP,
+    lease_until TIMESTAMP,
+    claim_token VARCHAR,
+    PRIMARY KEY (id, schedule_time)
+) PARTITION BY RANGE (schedule_time);
+CREATE TABLE tasks_pdefault PARTITION OF tasks DEFAULT;
+CREATE INDEX ix_tasks_schedule_time ON tasks (schedule_time);
+"""
+
+_PARTITION_NAME = re.compile(r"^tasks_p(\d{4})(\d{2})$")
+
+# Held by the one process (e.g. one gunicorn worker) that runs the retention job.
+retention_lock = ProcessLock("retention")
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Retention settings for old tasks.
+
+    Attributes:
+        result_days: Clear `result` of terminal tasks older than this (status is kept).
+        delete_days: Delete terminal tasks older than this.
+        archive_dir: If set, rows are appended to gzip JSON-lines files here before
+            their result is cleared or the row is deleted.
+        batch_size: Rows touched per transaction.
+        batch_pause: Seconds to sleep between batches so other writers get the table.
+        interval_minutes: How often the scheduler runs the job.
+        partitions: Manage monthly partitions (Postgres, partitioned `tasks` only).
+    """
+
+    result_days: Optional[int] = None
+    delete_days: Optional[int] = None
+    archive_dir: Optional[Path] = None
+    batch_size: int = 500
+    batch_pause: float = 0.05
+    interval_minutes: int = 60
+    partitions: bool = False
+
+    @classmethod
+    def from_env(cls) -> Optional["RetentionPolicy"]:
+        """Build a policy from RETENTION_* environment variables, or None if none is set."""
+        result_days = os.getenv("RETENTION_RESULT_DAYS")
+        delete_days = os.getenv("RETENTION_DELETE_DAYS")
+        if not result_days and not delete_days:
+            return None
+        archive_dir = os.getenv("RETENTION_ARCHIVE_DIR")
+        return cls(
+            result_days=int(result_days) if result_days else None,
+            delete_days=int(delete_days) if delete_days else None,
+            archive_dir=Path(archive_dir) if archive_dir else None,
+            batch_size=int(os.getenv("RETENTION_BATCH_SIZE", "500")),
+            batch_pause=float(os.getenv("RETENTION_BATCH_PAUSE", "0.05")),
+            interval_minutes=int(os.getenv("RETENTION_INTERVAL_MINUTES", "60")),
+            partitions=os.getenv("RETENTION_PARTITIONS") == "1",
+        )
+
+
+@dataclass
+class RetentionReport:
+    """Counts from one retention run."""
+
+    results_cleared: int = 0
+    deleted: int = 0
+    archived: int = 0
+    partitions_dropped: list[str] = field(default_factory=list)
+
+
+class _Archive:
+    """Lazily opened gzip JSON-lines archive for one retention run."""
+
+    def __init__(self, directory: Optional[Path]) -> None:
+        self.directory = directory
+        self._fh: Optional[IO[bytes]] = None
+
+    def write(self, tasks: list[Task]) -> int:
+        if self.directory is None or not tasks:
+            return 0
+        if self._fh is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            name = f"tasks-{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}.jsonl.gz"
+            self._fh = gzip.open(self.directory / name, "ab")
+        for task in tasks:
+            row = {
+                "id": task.id,
+                "schedule_time": task.schedule_time.isoformat(),
+                "lines": task.lines,
+                "status": task.status,
+                "result": task.result,
+            }
+            self._fh.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+        # Flush before the rows are removed, so the archive is never behind the DB.
+        self._fh.flush()
+        return len(tasks)
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def _expired(cutoff: datetime, *criteria):
+    # Snapshots that newer delta/same results still refer to are kept until
+    # those results expire too.
+    dependant = aliased(Task)
+    return select(Task).where(
+        Task.status.in_(TERMINAL_STATUSES),
+        Task.schedule_time < cutoff,
+        ~exists().where(dependant.result_base_id == Task.id),
+        *criteria,
+    )
+
+
+def clear_results(db: Session, cutoff: datetime, policy: RetentionPolicy, archive: _Archive) -> tuple[int, int]:
+    """Null out results of terminal tasks scheduled before `cutoff`, in batches.
+
+    Returns:
+        tuple[int, int]: (rows cleared, rows archived).
+    """
+    cleared = archived = 0
+    while True:
+        batch = list(
+            db.scalars(
+                _expired(cutoff, or_(Task.result.is_not(None), Task.result_base_id.is_not(None)))
+                .order_by(Task.id)
+                .limit(policy.batch_size)
+            )
+        )
+        if not batch:
+            return cleared, archived
+        archived += archive.write(materialize_results(db, batch))
+        ids = [t.id for t in batch]
+        db.execute(
+            update(Task)
+            .where(Task.id.in_(ids))
+            .values(result=None, result_kind=None, result_base_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        invalidate_tasks(ids)
+        db.expunge_all()
+        cleared += len(ids)
+        if len(ids) < policy.batch_size:
+            return cleared, archived
+        time.sleep(policy.batch_pause)
+
+
+def delete_expired(db: Session, cutoff: datetime, policy: RetentionPolicy, archive: _Archive) -> tuple[int, int]:
+    """Delete terminal tasks scheduled before `cutoff`, in batches.
+
+    Returns:
+        tuple[int, int]: (rows deleted, rows archived).
+    """
+    deleted = archived = 0
+    while True:
+        batch = list(db.scalars(_expired(cutoff).order_by(Task.id).limit(policy.batch_size)))
+        if not batch:
+            return deleted, archived
+        archived += archive.write(materialize_results(db, batch))
+        ids = [t.id for t in batch]
+        db.execute(delete(Task).where(Task.id.in_(ids)).execution_options(synchronize_session=False))
+        db.commit()
+        invalidate_tasks(ids)
+        db.expunge_all()
+        deleted += len(ids)
+        if len(ids) < policy.batch_size:
+            return deleted, archived
+        time.sleep(policy.batch_pause)
+
+
+def _month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def _next_month(value: date) -> date:
+    return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def is_partitioned(conn: Connection) -> bool:
+    """Return True if `tasks` is a partitioned Postgres table."""
+    if conn.dialect.name != "postgresql":
+        return False
+    return bool(
+        conn.execute(
+            text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('tasks')")
+        ).first()
+    )
+
+
+def ensure_partitions(conn: Connection, today: date, months_ahead: int = 3) -> list[str]:
+    """Create monthly partitions from the current month up to `months_ahead`.
+
+    A month whose rows already landed in the DEFAULT partition is skipped (and
+    logged); those rows stay in the default partition.
+
+    Returns:
+        list[str]: Names of the partitions created.
+    """
+    created: list[str] = []
+    start = _month_start(today)
+    for _ in range(months_ahead + 1):
+        end = _next_month(start)
+        name = f"tasks_p{start:%Y%m}"
+        exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+        if not exists:
+            try:
+                with conn.begin_nested():
+                    conn.exec_driver_sql(
+                        f"CREATE TABLE {name} PARTITION OF tasks "
+                        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                    )
+                created.append(name)
+            except Exception:  # noqa: BLE001
+                log.warning("retention: could not create partition", extra={"partition": name}, exc_info=True)
+        start = end
+    return created
+
+
+def drop_partitions_before(conn: Connection, cutoff: datetime, archive: _Archive) -> list[str]:
+    """Drop monthly partitions that end on or before `cutoff`.
+
+    Dropping a partition is O(1) regardless of its row count. Results in other
+    partitions diffed against its rows are given their full payload first, and
+    when archiving is enabled its rows are archived. A partition still holding
+    tasks that are not completed/failed is kept; its terminal tasks are left
+    to `delete_expired`.
+
+    Returns:
+        list[str]: Names of the partitions dropped.
+    """
+    names = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('tasks')"
+        )
+    ).scalars()
+
+    dropped: list[str] = []
+    for name in sorted(names):
+        match = _PARTITION_NAME.match(name)
+        if not match:
+            continue
+        end = _next_month(date(int(match.group(1)), int(match.group(2)), 1))
+        if datetime.combine(end, datetime.min.time()) > cutoff:
+            continue
+        # Held until the drop, so no task can be added or change status in between.
+        conn.exec_driver_sql(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE")
+        unfinished = conn.execute(
+            text(f"SELECT count(*) FROM {name} WHERE status NOT IN :statuses").bindparams(
+                bindparam("statuses", expanding=True)
+            ),
+            {"statuses": list(TERMINAL_STATUSES)},
+        ).scalar()
+        if unfinished:
+            log.warning(
+                "retention: partition kept, it holds unfinished tasks", extra={"partition": name, "count": unfinished}
+            )
+            continue
+        snapshot_ids = list(
+            conn.execute(text(f"SELECT id FROM {name} WHERE result_kind IS NULL OR result_kind = 'full'")).scalars()
+        )
+        detach_dependants(conn, snapshot_ids)
+        if archive.directory is not None:
+            rows = conn.execute(
+                text(f"SELECT id, schedule_time, lines, status, result, result_kind, result_base_id FROM {name}")
+            ).all()
+            base_ids = {row.result_base_id for row in rows if row.result_base_id is not None}
+            bases = dict(conn.execute(select(Task.id, Task.result).where(Task.id.in_(base_ids))).all())
+            archive.write(
+                [
+                    Task(
+                        id=row.id,
+                        schedule_time=row.schedule_time,
+                        lines=row.lines,
+                        status=row.status,
+                        result=deltas.resolve(row.result_kind, row.result, bases.get(row.result_base_id)),
+                    )
+                    for row in rows
+                ]
+            )
+        conn.exec_driver_sql(f"DROP TABLE {name}")
+        dropped.append(name)
+    return dropped
+
+
+def apply_retention(policy: RetentionPolicy, now: Optional[datetime] = None) -> RetentionReport:
+    """Run one pass of the retention policy.
+
+    Args:
+        policy: Retention settings.
+        now: Reference time (defaults to the current local time).
+
+    Returns:
+        RetentionReport: What was cleared, deleted, archived and dropped.
+    """
+    now = now or datetime.now()
+    report = RetentionReport()
+    archive = _Archive(policy.archive_dir)
+    started = time.perf_counter()
+
+    try:
+        if policy.partitions:
+            with get_engine().begin() as conn:
+                if is_partitioned(conn):
+                    ensure_partitions(conn, now.date())
+                    if policy.delete_days is not None:
+                        report.partitions_dropped = drop_partitions_before(
+                            conn, now - timedelta(days=policy.delete_days), archive
+                        )
+            if report.partitions_dropped:
+                invalidate_all_tasks()
+
+        db: Session = SessionLocal()
+        try:
+            if policy.delete_days is not None:
+                report.deleted, archived = delete_expired(db, now - timedelta(days=policy.delete_days), policy, archive)
+                report.archived += archived
+            if policy.result_days is not None:
+                report.results_cleared, archived = clear_results(
+                    db, now - timedelta(days=policy.result_days), policy, archive
+                )
+                report.archived += archived
+        finally:
+            db.close()
+    finally:
+        archive.close()
+
+    log.info(
+        "retention: done",
+        extra={
+            "results_cleared": report.results_cleared,
+            "deleted": report.deleted,
+            "archived": report.archived,
+            "partitions_dropped": report.partitions_dropped,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        },
+    )
+    return report
+
+
+def run_retention(policy: RetentionPolicy) -> Optional[RetentionReport]:
+    """Run `apply_retention` if this process holds the retention lock.
+
+    Every worker schedules the job, but only the lock holder runs it, so
+    passes never compete for the same rows or archive them twice.
+
+    Args:
+        policy: Retention settings.
+
+    Returns:
+        Optional[RetentionReport]: The report, or None if another process runs retention.
+    """
+    if not retention_lock.try_acquire():
+        log.debug("retention: skipped, another process holds the lock")
+        return None
+    return apply_retention(policy)
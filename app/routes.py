@@ -1,19 +1,24 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime
+import os
+from datetime import datetime, timedelta
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status, Response
 from sqlalchemy.orm import Session
 from starlette.concurrency import run_in_threadpool
 
-from . import crud, schemas
+from . import crud, http_cache, schemas
+from .admission import admission
 from .auth import require_auth
-from .database import get_db
-from .scheduler import schedule_task
+from .database import get_db, get_engine, pool_metrics
+from .replicas import get_read_db, mark_written
+from .responses import FastJSONResponse, ResultFormat, task_payload
+from .scheduler import schedule_task, unschedule_task
+from .task_cache import task_cache
 
-router = APIRouter()
+router = APIRouter(default_response_class=FastJSONResponse)
 
 # router = APIRouter(dependencies=[Depends(require_auth())])
 
@@ -21,20 +26,25 @@ log = logging.getLogger(__name__)
 
 
 @router.post("/tasks", response_model=schemas.TaskOut, status_code=status.HTTP_201_CREATED)
-async def create_task(task_in: schemas.TaskCreate, db: Annotated[Session, Depends(get_db)]) -> schemas.TaskOut:
+async def create_task(
+    task_in: schemas.TaskCreate, response: Response, db: Annotated[Session, Depends(get_db)]
+) -> schemas.TaskOut:
     """Create a new scheduled TfL disruption task.
 
-    If schedule_time is empty, the task is scheduled to run immediately.
+    If schedule_time is empty, the task is scheduled to run immediately. Tasks
+    due immediately are refused with 429 and Retry-After while the due queue
+    is deeper than their priority class allows.
 
     Args:
-        task_in: Payload containing desired schedule time and target lines.
+        task_in: Payload containing desired schedule time, target lines and priority.
+        response: Outgoing response (for the read-your-writes cookie).
         db: Injected SQLAlchemy session.
 
     Returns:
         TaskOut: The created task representation.
 
     Raises:
-        HTTPException: If validation fails.
+        HTTPException: If validation fails, or 429 if the task is not admitted.
     """
     log.info(
         "create_task: received",
@@ -53,8 +63,24 @@ async def create_task(task_in: schemas.TaskCreate, db: Annotated[Session, Depend
         )
         raise HTTPException(status_code=400, detail=str(ve)) from ve
 
-    task = await run_in_threadpool(crud.create_task, db, schedule_time=schedule_time, lines=lines)
+    if schedule_time <= datetime.now():
+        retry_after = admission.retry_after(task_in.priority)
+        if retry_after is not None:
+            log.warning(
+                "create_task: rejected, due queue full",
+                extra={"priority": task_in.priority, "depth": admission.depth(), "retry_after": retry_after},
+            )
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many tasks waiting to run; retry later",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+    task = await run_in_threadpool(
+        crud.create_task, db, schedule_time=schedule_time, lines=lines, priority=task_in.priority
+    )
     await run_in_threadpool(schedule_task, task)
+    mark_written(task.id, response)
 
     log.info(
         "create_task: scheduled",
@@ -65,29 +91,138 @@ async def create_task(task_in: schemas.TaskCreate, db: Annotated[Session, Depend
 
 
 @router.get("/tasks", response_model=list[schemas.TaskOut])
-async def list_tasks(db: Annotated[Session, Depends(get_db)]) -> list[schemas.TaskOut]:
-    """List all tasks.
+async def list_tasks(
+    request: Request,
+    response: Response,
+    db: Annotated[Session, Depends(get_read_db)],
+    result_format: ResultFormat = "string",
+    lines: str | None = None,
+) -> list[schemas.TaskOut]:
+    """List all tasks, optionally only those covering the given lines.
+
+    Answers 304 Not Modified when the client's If-None-Match still matches.
+    Only conditional requests run the aggregate validator query first; others
+    load the tasks once and derive the ETag from them.
 
     Args:
-        db: Injected SQLAlchemy session.
+        request: Incoming request (for conditional headers).
+        response: Outgoing response (for cache headers).
+        db: Injected read-only SQLAlchemy session (replica unless read-your-writes applies).
+        result_format: "raw" embeds completed results as JSON instead of strings.
+        lines: Comma-separated line IDs; only tasks including all of them are returned.
 
     Returns:
         list[TaskOut]: All tasks in the system.
+
+    Raises:
+        HTTPException: If `lines` contains an invalid line ID.
     """
-    tasks = await run_in_threadpool(crud.get_tasks, db)
-    
+    try:
+        lines_mask = schemas.lines_to_mask(lines) if lines else 0
+    except ValueError as ve:
+        log.warning("list_tasks: invalid input", extra={"error": str(ve)})
+        raise HTTPException(status_code=400, detail=str(ve)) from ve
+
+    variant = "" if result_format == "string" else result_format
+    if lines_mask:
+        variant = f"{variant}-l{lines_mask}"
+    if http_cache.is_conditional(request):
+        count, id_sum, version_sum, last_updated = await run_in_threadpool(crud.get_tasks_meta, db, lines_mask)
+        etag = http_cache.list_etag(count, id_sum, version_sum, last_updated, variant)
+        if http_cache.is_not_modified(request, etag, None):
+            log.info("list_tasks: not modified", extra={"count": count})
+            return http_cache.not_modified(http_cache.cache_headers(etag, None, terminal=False))
+
+    tasks = await run_in_threadpool(crud.get_tasks, db, lines_mask)
+    # The rows may be newer than the aggregates read above.
+    headers = http_cache.cache_headers(http_cache.rows_list_etag(tasks, variant), None, terminal=False)
+
     log.info("list_tasks: ok", extra={"count": len(tasks)})
 
+    if result_format == "raw":
+        return FastJSONResponse([task_payload(t, result_format) for t in tasks], headers=headers)
+    response.headers.update(headers)
+    return tasks
+
+
+@router.get("/tasks/changes", response_model=list[schemas.TaskOut])
+async def list_changes(
+    response: Response,
+    db: Annotated[Session, Depends(get_read_db)],
+    cursor: str | None = None,
+    lines: str | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    result_format: ResultFormat = "string",
+) -> list[schemas.TaskOut]:
+    """Feed of completed tasks whose result changed since the previous run for the same lines.
+
+    Only populated when delta mode (RESULT_DELTA_MODE=1) is enabled. Tasks are
+    returned in the order their results were stored. Pass the returned
+    `X-Next-Cursor` header back as `cursor` to page forward. Changes younger
+    than CHANGES_FEED_SETTLE_SECONDS (default 2) are held back until writes in
+    flight have committed.
+
+    Args:
+        response: Outgoing response (for the cursor header).
+        db: Injected read-only SQLAlchemy session (replica unless read-your-writes applies).
+        cursor: Position returned by the previous page; omit to start from the beginning.
+        lines: Comma-separated line IDs; only tasks including all of them are returned.
+        limit: Maximum number of tasks to return.
+        result_format: "raw" embeds completed results as JSON instead of strings.
+
+    Returns:
+        list[TaskOut]: Changed tasks, oldest change first.
+
+    Raises:
+        HTTPException: If `lines` contains an invalid line ID or `cursor` is malformed.
+    """
+    try:
+        lines_mask = schemas.lines_to_mask(lines) if lines else 0
+        after = crud.parse_changes_cursor(cursor) if cursor else None
+    except ValueError as ve:
+        log.warning("list_changes: invalid input", extra={"error": str(ve)})
+        raise HTTPException(status_code=400, detail=str(ve)) from ve
+
+    settle = float(os.getenv("CHANGES_FEED_SETTLE_SECONDS", "2"))
+    tasks = await run_in_threadpool(
+        crud.get_changes,
+        db,
+        after=after,
+        settled_before=datetime.now() - timedelta(seconds=settle),
+        lines_mask=lines_mask,
+        limit=limit,
+    )
+    headers = {"X-Next-Cursor": crud.changes_cursor(tasks[-1]) if tasks else (cursor or "")}
+
+    log.info("list_changes: ok", extra={"count": len(tasks), "cursor": cursor})
+
+    if result_format == "raw":
+        return FastJSONResponse([task_payload(t, result_format) for t in tasks], headers=headers)
+    response.headers.update(headers)
     return tasks
 
 
 @router.get("/tasks/{task_id}", response_model=schemas.TaskOut)
-async def get_task(task_id: int, db: Annotated[Session, Depends(get_db)]) -> schemas.TaskOut:
+async def get_task(
+    task_id: int,
+    request: Request,
+    response: Response,
+    db: Annotated[Session, Depends(get_read_db)],
+    result_format: ResultFormat = "string",
+) -> schemas.TaskOut:
     """Retrieve a single task by ID.
 
+    For conditional requests the validators are checked first against a
+    lightweight query, so a matching If-None-Match / If-Modified-Since is
+    answered with 304 without loading `result`. Other requests load the row once.
+    With TASK_CACHE=1 the serialized response is served from the in-process cache.
+
     Args:
         task_id: Task identifier.
-        db: Injected SQLAlchemy session.
+        request: Incoming request (for conditional headers).
+        response: Outgoing response (for cache headers).
+        db: Injected read-only SQLAlchemy session (replica unless read-your-writes applies).
+        result_format: "raw" embeds a completed result as JSON instead of a string.
 
     Returns:
         TaskOut: Task representation including current status and result (if any).
@@ -95,22 +230,70 @@ async def get_task(task_id: int, db: Annotated[Session, Depends(get_db)]) -> sch
     Raises:
         HTTPException: If the task cannot be found.
     """
+    variant = "" if result_format == "string" else result_format
+    if task_cache is not None:
+        cached = task_cache.get(task_id, variant)
+        if cached is not None:
+            if http_cache.is_not_modified(request, cached.etag, cached.last_modified):
+                return http_cache.not_modified(cached.headers)
+            log.info("get_task: cache hit", extra={"task_id": task_id})
+            return Response(cached.body, media_type="application/json", headers=cached.headers)
+        # Taken before the read so a concurrent update or delete keeps the row out of the cache.
+        generation = task_cache.generation()
+
+    if http_cache.is_conditional(request):
+        meta = await run_in_threadpool(crud.get_task_meta, db, task_id)
+        if not meta:
+            log.warning("get_task: not found", extra={"task_id": task_id})
+            raise HTTPException(status_code=404, detail="Task not found")
+
+        etag = http_cache.task_etag(meta.id, meta.version, variant)
+        headers = http_cache.cache_headers(etag, meta.updated_at, meta.status in http_cache.TERMINAL_STATUSES)
+        if http_cache.is_not_modified(request, etag, meta.updated_at):
+            log.info("get_task: not modified", extra={"task_id": task_id, "status": meta.status})
+            return http_cache.not_modified(headers)
+
     task = await run_in_threadpool(crud.get_task, db, task_id)
     if not task:
         log.warning("get_task: not found", extra={"task_id": task_id})
         raise HTTPException(status_code=404, detail="Task not found")
-    
+
+    # The full row may be newer than the validators read above.
+    etag = http_cache.task_etag(task.id, task.version, variant)
+    terminal = task.status in http_cache.TERMINAL_STATUSES
+    headers = http_cache.cache_headers(etag, task.updated_at, terminal)
+
     log.info("get_task: ok", extra={"task_id": task_id, "status": task.status})
-    return task
+
+    if task_cache is None and result_format == "string":
+        response.headers.update(headers)
+        return task
+    rendered = FastJSONResponse(task_payload(task, result_format), headers=headers)
+    if task_cache is not None:
+        task_cache.put(
+            task_id,
+            variant,
+            body=rendered.body,
+            headers=headers,
+            etag=etag,
+            last_modified=task.updated_at,
+            terminal=terminal,
+            from_replica=db.get_bind() is not get_engine(),
+            generation=generation,
+        )
+    return rendered
 
 
 @router.patch("/tasks/{task_id}", response_model=schemas.TaskOut)
-async def update_task(task_id: int, updates: schemas.TaskUpdate, db: Annotated[Session, Depends(get_db)]) -> schemas.TaskOut:
-    """Update an existing task's schedule time and/or lines (only if still scheduled).
+async def update_task(
+    task_id: int, updates: schemas.TaskUpdate, response: Response, db: Annotated[Session, Depends(get_db)]
+) -> schemas.TaskOut:
+    """Update an existing task's schedule time, lines and/or priority (only if still scheduled).
 
     Args:
         task_id: Task identifier.
         updates: Fields to update.
+        response: Outgoing response (for the read-your-writes cookie).
         db: Injected SQLAlchemy session.
 
     Returns:
@@ -144,9 +327,11 @@ async def update_task(task_id: int, updates: schemas.TaskUpdate, db: Annotated[S
         task,
         schedule_time=new_time if new_time is not None else None,
         lines=norm_lines,
+        priority=updates.priority,
     )
 
     await run_in_threadpool(schedule_task, updated)
+    mark_written(updated.id, response)
 
     log.info(
         "update_task: ok",
@@ -176,7 +361,33 @@ async def delete_task(task_id: int, db: Annotated[Session, Depends(get_db)]) ->
         raise HTTPException(status_code=404, detail="Task not found")
 
     await run_in_threadpool(crud.delete_task, db, task)
+    await run_in_threadpool(unschedule_task, task_id)
 
     log.info("delete_task: ok", extra={"task_id": task_id})
 
-    return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    response = Response(status_code=status.HTTP_204_NO_CONTENT)
+    mark_written(task_id, response)
+    return response
+
+
+@router.get("/metrics/db")
+async def db_metrics() -> dict:
+    """Connection pool metrics per database pool ('primary' and, if configured, 'replica').
+
+    Returns:
+        dict: Pool name to counters (connects, checkouts, connections in use,
+        hold times) and the pool's current size and overflow.
+    """
+    return pool_metrics()
+
+
+@router.get("/metrics/task-cache")
+async def task_cache_metrics() -> dict:
+    """Hit ratio, size and counters of the in-process task read cache.
+
+    Returns:
+        dict: Cache statistics, or {"enabled": False} when TASK_CACHE is not set.
+    """
+    if task_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **task_cache.stats()}
\ No newline at end of file
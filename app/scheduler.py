@@ -1,57 +1,220 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Optional
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Optional
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.date import DateTrigger
 from sqlalchemy.orm import Session
 
-from .crud import get_task
+from . import deltas
+from .admission import DEFAULT_PRIORITY, admission, worker_counts
+from .crud import claim_task, finish_task, get_task
 from .database import SessionLocal
 from .models import Task
-from .tfl_client import fetch_disruptions
+from .replicas import mark_written
+from .timer_wheel import WheelScheduler
+from .write_buffer import write_buffer
 
-scheduler = BackgroundScheduler()
+if TYPE_CHECKING:
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+log = logging.getLogger(__name__)
+
+# APScheduler (and the TfL client's `requests`) are imported on first use, so
+# importing the app stays cheap. See `get_scheduler` and `fetch_disruptions`.
+_scheduler: Optional[BackgroundScheduler] = None
+_scheduler_lock = threading.Lock()
+
+# Priority of each pending APScheduler job, consumed when the job is submitted.
+_job_priorities: dict[str, str] = {}
+
+# A claim expires after this many seconds unless the claiming process renews
+# it (app.lifecycle.TaskSupervisor), so runs of a killed process are recovered.
+LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", "30"))
+
+# Set while shutting down: run_task stops claiming new work.
+draining = threading.Event()
+_in_flight: set[int] = set()
+_in_flight_lock = threading.Lock()
+
+
+def _executor_for(priority: str) -> str:
+    return "default" if priority == DEFAULT_PRIORITY else priority
+
+
+def _pool_executor(priority: str, size: int) -> Any:
+    """APScheduler thread pool for one priority class that keeps admission depth in step.
+
+    A task run is counted as queued before it is handed to the pool, so the
+    worker's `admission.started` can never run before the matching `submitted`.
+    """
+    from apscheduler.executors.pool import ThreadPoolExecutor
+
+    class AdmissionPoolExecutor(ThreadPoolExecutor):
+        def _do_submit_job(self, job, run_times):
+            counted = _job_priorities.pop(job.id, None) is not None
+            if counted:
+                admission.submitted(priority)
+            try:
+                super()._do_submit_job(job, run_times)
+            except Exception:
+                if counted:
+                    admission.started(priority)
+                raise
+
+    return AdmissionPoolExecutor(size)
+
+
+def get_scheduler() -> BackgroundScheduler:
+    """Return the process-wide APScheduler instance, creating it on first call.
+
+    There is one worker pool per priority class, so a backlog of low-priority
+    runs cannot hold up high-priority ones. 'normal' runs on APScheduler's
+    default executor.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from apscheduler.schedulers.background import BackgroundScheduler
+
+                _scheduler = BackgroundScheduler(
+                    executors={
+                        _executor_for(priority): _pool_executor(priority, size)
+                        for priority, size in worker_counts().items()
+                    }
+                )
+    return _scheduler
+
+
+def scheduler_running() -> bool:
+    """Return True if the APScheduler instance exists and has been started."""
+    return _scheduler is not None and _scheduler.running
+
+
+def __getattr__(name: str) -> Any:
+    # Backwards compatible `from app.scheduler import scheduler`.
+    if name == "scheduler":
+        return get_scheduler()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def fetch_disruptions(lines: str) -> str:
+    """Fetch disruptions via `tfl_client`, importing it (and `requests`) on first use."""
+    from . import tfl_client
+
+    return tfl_client.fetch_disruptions(lines)
+
+
+def _completed_values(db: Session, task: Task, payload: str) -> dict[str, Any]:
+    """Column values for a completed task, diffed against the previous result in delta mode."""
+    if not deltas.delta_mode_enabled():
+        return {"result": payload}
+    try:
+        encoded = deltas.encode(db, task, payload)
+    except Exception:  # noqa: BLE001
+        log.exception("run_task: delta encoding failed, storing full result", extra={"task_id": task.id})
+        encoded = deltas.EncodedResult(deltas.FULL, payload, None, True)
+    return {
+        "result": encoded.result,
+        "result_kind": encoded.kind,
+        "result_base_id": encoded.base_id,
+        "changed": encoded.changed,
+        "changed_at": datetime.now(),
+    }
 
 
 def run_task(task_id: int) -> None:
     """Execute the scheduled TfL fetch for a given task ID.
 
     This transitions the task through statuses: 'running' → ('completed'|'failed').
+    The task is first claimed with a conditional update, so it only runs if it
+    is still 'scheduled'. The final transition only lands while the claim still
+    holds the task: a run handed back by `drain` or reset by the orphan sweeper
+    (and possibly claimed again elsewhere) has its result dropped. When the
+    write-behind buffer is enabled the final transition is handed to it instead
+    of being committed directly. While the process is draining no new task is
+    claimed.
 
     Args:
         task_id: Identifier of the task to run.
     """
+    with _in_flight_lock:
+        if draining.is_set():
+            log.info("run_task: draining, left scheduled", extra={"task_id": task_id})
+            return
+        _in_flight.add(task_id)
+
     db: Session = SessionLocal()
     try:
+        claim = claim_task(db, task_id, lease_until=datetime.now() + timedelta(seconds=LEASE_SECONDS))
+        if claim is None:
+            return
+        mark_written(task_id)
         task: Optional[Task] = get_task(db, task_id)
         if task is None:
             return
 
-        task.status = "running"
-        db.commit()
-
         try:
-            task.result = fetch_disruptions(task.lines)
-            task.status = "completed"
+            payload = fetch_disruptions(task.lines)
         except Exception as exc:  # noqa: BLE001
-            task.result = f"{type(exc).__name__}: {exc}"
-            task.status = "failed"
-        finally:
-            db.commit()
+            status, values = "failed", {"result": f"{type(exc).__name__}: {exc}"}
+        else:
+            status, values = "completed", _completed_values(db, task, payload)
+
+        if write_buffer is not None:
+            write_buffer.record(task_id, status, claim_token=claim, **values)
+        elif not finish_task(db, task_id, claim, status, **values):
+            log.warning("run_task: claim lost, result dropped", extra={"task_id": task_id, "status": status})
+            return
+        mark_written(task_id)
     finally:
         db.close()
+        with _in_flight_lock:
+            _in_flight.discard(task_id)
+
+
+def in_flight() -> set[int]:
+    """Return the IDs of tasks currently running in this process."""
+    with _in_flight_lock:
+        return set(_in_flight)
+
+
+def run_queued_task(task_id: int, priority: str = DEFAULT_PRIORITY) -> None:
+    """Run a task handed over by a worker pool, keeping admission counters current.
+
+    Args:
+        task_id: Identifier of the task to run.
+        priority: Priority class the run was queued under.
+    """
+    admission.started(priority)
+    started = time.perf_counter()
+    try:
+        run_task(task_id)
+    finally:
+        admission.finished(time.perf_counter() - started)
 
 
 def schedule_task(task: Task) -> None:
     """Schedule or reschedule a task to run at its `schedule_time`.
 
-    Removes a prior job with the same ID (if any) to avoid duplicates.
+    Removes a prior job with the same ID (if any) to avoid duplicates. The job
+    runs on the worker pool of the task's priority class.
 
     Args:
         task: The task instance to schedule.
     """
+    priority = task.priority or DEFAULT_PRIORITY
+    if wheel is not None:
+        wheel.schedule(task.id, task.schedule_time, priority)
+        return
+
+    from apscheduler.triggers.date import DateTrigger
+
+    scheduler = get_scheduler()
     job_id = str(task.id)
     try:
         scheduler.remove_job(job_id)
@@ -59,4 +222,46 @@ def schedule_task(task: Task) -> None:
         pass
 
     trigger = DateTrigger(run_date=task.schedule_time)
-    scheduler.add_job(run_task, trigger, args=[task.id], id=job_id, misfire_grace_time=None)
+    _job_priorities[job_id] = priority
+    scheduler.add_job(
+        run_queued_task,
+        trigger,
+        args=[task.id, priority],
+        id=job_id,
+        executor=_executor_for(priority),
+        misfire_grace_time=None,
+    )
+
+
+def unschedule_task(task_id: int) -> None:
+    """Cancel any pending run of a task.
+
+    Args:
+        task_id: Identifier of the task.
+    """
+    if wheel is not None:
+        wheel.cancel(task_id)
+        return
+    _job_priorities.pop(str(task_id), None)
+    if _scheduler is None:
+        return
+    try:
+        _scheduler.remove_job(str(task_id))
+    except Exception:
+        pass
+
+
+# SCHEDULER_BACKEND=wheel runs one-shot tasks from a hierarchical timing wheel
+# instead of one APScheduler job per task. APScheduler is still used for
+# periodic maintenance jobs.
+wheel: Optional[WheelScheduler] = (
+    WheelScheduler(
+        run_queued_task,
+        tick=float(os.getenv("WHEEL_TICK_SECONDS", "0.1")),
+        workers=worker_counts(),
+        batch_size=int(os.getenv("WHEEL_BATCH_SIZE", "256")),
+        on_submit=admission.submitted,
+    )
+    if os.getenv("SCHEDULER_BACKEND", "apscheduler") == "wheel"
+    else None
+)
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Optional
+from functools import lru_cache
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field, ConfigDict
 
@@ -21,6 +22,74 @@ VALID_TUBE_LINES: set[str] = {
     "waterloo-city",
 }
 
+Priority = Literal["high", "normal", "low"]
+
+# Each line owns one bit, assigned in sorted order, so a set of lines is an
+# integer mask and the canonical (sorted) string follows from the bit order.
+TUBE_LINE_ORDER: tuple[str, ...] = tuple(sorted(VALID_TUBE_LINES))
+LINE_BITS: dict[str, int] = {line: 1 << i for i, line in enumerate(TUBE_LINE_ORDER)}
+ALL_LINES_MASK: int = (1 << len(TUBE_LINE_ORDER)) - 1
+
+# Canonical comma-separated form of every possible mask (2**11 entries).
+_MASK_TO_LINES: tuple[str, ...] = tuple(
+    ",".join(line for line in TUBE_LINE_ORDER if mask & LINE_BITS[line]) for mask in range(ALL_LINES_MASK + 1)
+)
+
+
+def lines_to_mask(lines: str) -> int:
+    """Parse comma-separated line IDs (any order, case, spacing, duplicates) into a mask.
+
+    Args:
+        lines: Comma-separated tube line IDs.
+
+    Raises:
+        ValueError: If any provided line ID is invalid.
+
+    Returns:
+        int: Bitmask of the given lines.
+    """
+    mask = 0
+    invalid: list[str] = []
+    for item in lines.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        bit = LINE_BITS.get(item)
+        if bit is None:
+            invalid.append(item)
+        else:
+            mask |= bit
+    if invalid:
+        raise ValueError(
+            f"Invalid line id(s): {', '.join(invalid)}. "
+            f"Valid tube lines: {', '.join(TUBE_LINE_ORDER)}"
+        )
+    return mask
+
+
+def mask_to_lines(mask: int) -> str:
+    """Return the canonical comma-separated line IDs for a mask."""
+    return _MASK_TO_LINES[mask]
+
+
+def canonical_lines(lines: str) -> str:
+    """Return validated line IDs in canonical form: lowercase, de-duplicated, sorted.
+
+    Raises:
+        ValueError: If any provided line ID is invalid.
+    """
+    return _MASK_TO_LINES[lines_to_mask(lines)]
+
+
+@lru_cache(maxsize=None)
+def masks_containing(required: int) -> tuple[int, ...]:
+    """Return every non-empty mask that includes all bits of `required`.
+
+    Used to turn "tasks containing these lines" into an indexed IN lookup on
+    the mask column instead of a bitwise scan.
+    """
+    return tuple(mask for mask in range(1, ALL_LINES_MASK + 1) if mask & required == required)
+
 
 class TaskCreate(BaseModel):
     """Input model for creating a task."""
@@ -28,6 +97,7 @@ class TaskCreate(BaseModel):
     schedule_time: Optional[datetime] = Field(default=None, alias="schedule_time")
     scheduler_time: Optional[datetime] = Field(default=None, alias="scheduler_time")
     lines: str = Field(..., description="Comma-separated TfL tube line IDs.")
+    priority: Priority = Field(default="normal", description="Priority class: high, normal or low.")
 
     model_config = ConfigDict(populate_by_name=True)
 
@@ -44,7 +114,7 @@ class TaskCreate(BaseModel):
         return dt.replace(microsecond=0)
 
     def normalized_lines(self) -> str:
-        """Return normalized, comma-separated, validated tube line IDs.
+        """Return canonical (sorted, de-duplicated), validated tube line IDs.
 
         Raises:
             ValueError: If any provided line ID is invalid.
@@ -52,14 +122,7 @@ class TaskCreate(BaseModel):
         Returns:
             str: Normalized comma-separated line IDs.
         """
-        items: list[str] = [s.strip().lower() for s in self.lines.split(",") if s.strip()]
-        invalid: list[str] = [x for x in items if x not in VALID_TUBE_LINES]
-        if invalid:
-            raise ValueError(
-                f"Invalid line id(s): {', '.join(invalid)}. "
-                f"Valid tube lines: {', '.join(sorted(VALID_TUBE_LINES))}"
-            )
-        return ",".join(items)
+        return canonical_lines(self.lines)
 
 
 class TaskUpdate(BaseModel):
@@ -68,6 +131,7 @@ class TaskUpdate(BaseModel):
     schedule_time: Optional[datetime] = None
     scheduler_time: Optional[datetime] = Field(default=None, alias="scheduler_time")
     lines: Optional[str] = Field(default=None, description="Comma-separated TfL tube line IDs.")
+    priority: Optional[Priority] = Field(default=None, description="Priority class: high, normal or low.")
 
     model_config = ConfigDict(populate_by_name=True)
 
@@ -83,18 +147,11 @@ class TaskUpdate(BaseModel):
             ValueError: If any provided line ID is invalid.
 
         Returns:
-            Optional[str]: Normalized comma-separated line IDs, or None if missing.
+            Optional[str]: Canonical comma-separated line IDs, or None if missing.
         """
         if self.lines is None:
             return None
-        items: list[str] = [s.strip().lower() for s in self.lines.split(",") if s.strip()]
-        invalid: list[str] = [x for x in items if x not in VALID_TUBE_LINES]
-        if invalid:
-            raise ValueError(
-                f"Invalid line id(s): {', '.join(invalid)}. "
-                f"Valid tube lines: {', '.join(sorted(VALID_TUBE_LINES))}"
-            )
-        return ",".join(items)
+        return canonical_lines(self.lines)
 
 
 class TaskOut(BaseModel):
@@ -104,6 +161,8 @@ class TaskOut(BaseModel):
     schedule_time: datetime
     lines: str
     status: str
+    priority: str = "normal"
     result: Optional[str] = None
+    changed: Optional[bool] = None
 
     model_config = ConfigDict(from_attributes=True)
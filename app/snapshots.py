@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+# File layout: an 8-byte magic followed by append-only records of
+#   [payload length: u32][lines mask: u32][timestamp: f64][payload: bytes]
+# (little endian). Records are never rewritten, so a file being recorded can
+# be read at the same time, and a torn final record is ignored.
+MAGIC = b"TFLSNAP1"
+_HEADER = struct.Struct("<IId")
+
+
+class SnapshotWriter:
+    """Appends TfL responses to a snapshot file.
+
+    Several processes (e.g. gunicorn workers in record mode) may write the
+    same file: the magic and every record are written under an exclusive
+    `flock`, so the header is written once and records never interleave.
+
+    Args:
+        path: Snapshot file; created (with its magic) if missing.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._fh = open(self.path, "ab")
+        with self._exclusive():
+            if os.fstat(self._fh.fileno()).st_size == 0:
+                self._fh.write(MAGIC)
+                self._fh.flush()
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fh, fcntl.LOCK_UN)
+
+    def append(self, lines_mask: int, payload: str, timestamp: Optional[float] = None) -> None:
+        """Append one response.
+
+        Args:
+            lines_mask: Bitmask of the line set the response is for.
+            payload: Raw response body.
+            timestamp: Epoch seconds the response was fetched at (defaults to now).
+        """
+        body = payload.encode("utf-8")
+        record = _HEADER.pack(len(body), lines_mask, time.time() if timestamp is None else timestamp) + body
+        with self._exclusive():
+            self._fh.write(record)
+            self._fh.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._fh.close()
+
+
+class SnapshotReader:
+    """Memory-mapped, read-only view of a snapshot file, indexed by (lines mask, timestamp).
+
+    Opening the file scans the record headers once; payloads stay in the page
+    cache and are only decoded when served.
+
+    Args:
+        path: Snapshot file written by SnapshotWriter.
+
+    Raises:
+        ValueError: If the file is not a snapshot file.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < len(MAGIC):
+                raise ValueError(f"{self.path} is not a TfL snapshot file")
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f"{self.path} is not a TfL snapshot file")
+        # lines mask -> (sorted timestamps, payload (offset, length) in the same order)
+        self._index: dict[int, tuple[list[float], list[tuple[int, int]]]] = {}
+        self._count = 0
+        self._scan(size)
+
+    def _scan(self, size: int) -> None:
+        entries: dict[int, list[tuple[float, int, int]]] = {}
+        offset = len(MAGIC)
+        while offset + _HEADER.size <= size:
+            length, mask, timestamp = _HEADER.unpack_from(self._map, offset)
+            start = offset + _HEADER.size
+            if start + length > size:
+                break
+            entries.setdefault(mask, []).append((timestamp, start, length))
+            offset = start + length
+            self._count += 1
+        for mask, records in entries.items():
+            records.sort(key=lambda record: record[0])
+            self._index[mask] = ([r[0] for r in records], [(r[1], r[2]) for r in records])
+
+    def __len__(self) -> int:
+        return self._count
+
+    def masks(self) -> list[int]:
+        """Line-set masks that have at least one recording."""
+        return list(self._index)
+
+    def count(self, lines_mask: int) -> int:
+        """Number of recordings for a line set."""
+        return len(self._index.get(lines_mask, ((), ()))[0])
+
+    def time_range(self) -> tuple[float, float]:
+        """(first, last) recording timestamp over all line sets.
+
+        Raises:
+            LookupError: If the file holds no recordings.
+        """
+        if not self._index:
+            raise LookupError(f"{self.path} holds no recordings")
+        return (
+            min(timestamps[0] for timestamps, _ in self._index.values()),
+            max(timestamps[-1] for timestamps, _ in self._index.values()),
+        )
+
+    def _payload(self, location: tuple[int, int]) -> str:
+        start, length = location
+        return self._map[start : start + length].decode("utf-8")
+
+    def nth(self, lines_mask: int, n: int) -> str:
+        """Return the n-th recording (in time order) for a line set, wrapping around.
+
+        Raises:
+            LookupError: If the line set was never recorded.
+        """
+        timestamps, locations = self._entries(lines_mask)
+        return self._payload(locations[n % len(timestamps)])
+
+    def at(self, lines_mask: int, timestamp: float) -> str:
+        """Return the latest recording for a line set taken at or before `timestamp`.
+
+        Before the first recording, the first one is returned.
+
+        Raises:
+            LookupError: If the line set was never recorded.
+        """
+        timestamps, locations = self._entries(lines_mask)
+        index = max(0, bisect.bisect_right(timestamps, timestamp) - 1)
+        return self._payload(locations[index])
+
+    def _entries(self, lines_mask: int) -> tuple[list[float], list[tuple[int, int]]]:
+        try:
+            return self._index[lines_mask]
+        except KeyError:
+            raise LookupError(f"no recorded snapshot for lines mask {lines_mask}") from None
+
+    def close(self) -> None:
+        self._map.close()
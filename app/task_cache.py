@@ -0,0 +1,353 @@
+from __future__ import annotations
+
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+
+from . import database
+
+log = logging.getLogger(__name__)
+
+CHANNEL = "task_cache"
+# NOTIFY payload telling every worker to drop all entries.
+_CLEAR_ALL = "*"
+# Postgres NOTIFY payloads are limited to 8000 bytes.
+_NOTIFY_MAX_PAYLOAD = 7900
+# Per-entry bookkeeping on top of the body (key, headers, OrderedDict node).
+_ENTRY_OVERHEAD = 300
+# Recent invalidations remembered to refuse puts of rows read before them.
+_MAX_TRACKED = 10_000
+
+
+@dataclass
+class CachedResponse:
+    """A serialized task response and its cache validators."""
+
+    body: bytes
+    headers: dict[str, str]
+    etag: str
+    last_modified: Optional[datetime]
+    expires: Optional[float]
+    size: int
+
+
+class TaskCache:
+    """Byte-bounded LRU of serialized `GET /tasks/{id}` responses.
+
+    Terminal tasks never change, so they are kept until evicted or
+    invalidated (or for `terminal_ttl` seconds when set). Other tasks are kept
+    for `ttl` seconds. Writes in this process invalidate entries directly; with
+    Postgres they are also published with NOTIFY so other workers drop theirs.
+    Without NOTIFY, terminal entries expire after `fallback_ttl` so that
+    deletes in other workers are seen within that bound.
+
+    A reader takes `generation()` before reading a task and passes it to
+    `put`; the put is skipped if the task was invalidated in the meantime, so
+    a response read before a concurrent update or delete is never cached.
+
+    Args:
+        max_bytes: Total size of cached bodies (plus per-entry overhead).
+        ttl: Seconds to keep non-terminal tasks.
+        terminal_ttl: Seconds to keep terminal tasks; 0 keeps them until evicted.
+        fallback_ttl: Seconds to keep terminal tasks while cross-worker invalidation is unavailable.
+    """
+
+    def __init__(
+        self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 2.0, terminal_ttl: float = 0.0, fallback_ttl: float = 30.0
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.terminal_ttl = terminal_ttl
+        self.fallback_ttl = fallback_ttl
+        self._entries: OrderedDict[tuple[int, str], CachedResponse] = OrderedDict()
+        self._variants: dict[int, set[str]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._generation = 0
+        # task id -> generation of its last invalidation; puts read before `_floor` are refused.
+        self._invalidated: OrderedDict[int, int] = OrderedDict()
+        self._floor = 0
+        self._listener: Optional[_NotifyListener] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["TaskCache"]:
+        """Build a cache from TASK_CACHE* environment variables, or None if disabled."""
+        if os.getenv("TASK_CACHE") != "1":
+            return None
+        return cls(
+            max_bytes=int(os.getenv("TASK_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            ttl=float(os.getenv("TASK_CACHE_TTL", "2")),
+            terminal_ttl=float(os.getenv("TASK_CACHE_TERMINAL_TTL", "0")),
+            fallback_ttl=float(os.getenv("TASK_CACHE_STALE_SECONDS", "30")),
+        )
+
+    @property
+    def cross_worker(self) -> bool:
+        """True while invalidations from other workers are being received."""
+        return self._listener is not None and self._listener.connected.is_set()
+
+    def generation(self) -> int:
+        """Current invalidation generation; take it before reading a task to `put`."""
+        with self._lock:
+            return self._generation
+
+    def get(self, task_id: int, variant: str = "") -> Optional[CachedResponse]:
+        """Return the cached response, or None on a miss or an expired entry."""
+        key = (task_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry
+
+    def put(
+        self,
+        task_id: int,
+        variant: str,
+        *,
+        body: bytes,
+        headers: dict[str, str],
+        etag: str,
+        last_modified: Optional[datetime],
+        terminal: bool,
+        from_replica: bool = False,
+        generation: Optional[int] = None,
+    ) -> None:
+        """Cache a serialized response, evicting least recently used entries to stay within `max_bytes`.
+
+        Args:
+            task_id: Task the response is for.
+            variant: Response variant (e.g. result format).
+            body: Serialized response body.
+            headers: Cache validator headers sent with the body.
+            etag: ETag of the response.
+            last_modified: Last-Modified of the response.
+            terminal: The task is completed/failed.
+            from_replica: The task was read from a replica, which may still show a
+                task deleted on the primary; terminal entries then expire after `fallback_ttl`.
+            generation: `generation()` taken before the task was read; the put is
+                skipped if the task was invalidated since.
+        """
+        size = len(body) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        if terminal:
+            bounded = from_replica or not self.cross_worker
+            ttl = (self.terminal_ttl or self.fallback_ttl) if bounded else self.terminal_ttl
+        else:
+            ttl = self.ttl
+        entry = CachedResponse(body, headers, etag, last_modified, time.monotonic() + ttl if ttl else None, size)
+        key = (task_id, variant)
+        with self._lock:
+            if generation is not None and (
+                generation < self._floor or self._invalidated.get(task_id, -1) > generation
+            ):
+                return
+            self._remove(key)
+            self._entries[key] = entry
+            self._variants.setdefault(task_id, set()).add(variant)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def _remove(self, key: tuple[int, str]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        variants = self._variants.get(key[0])
+        if variants is not None:
+            variants.discard(key[1])
+            if not variants:
+                del self._variants[key[0]]
+
+    def discard(self, task_ids: Iterable[int]) -> int:
+        """Drop every cached variant of the given tasks in this process only.
+
+        Returns:
+            int: Number of entries dropped.
+        """
+        dropped = 0
+        with self._lock:
+            for task_id in task_ids:
+                self._generation += 1
+                self._invalidated[task_id] = self._generation
+                self._invalidated.move_to_end(task_id)
+                for variant in list(self._variants.get(task_id, ())):
+                    self._remove((task_id, variant))
+                    dropped += 1
+            while len(self._invalidated) > _MAX_TRACKED:
+                _, forgotten = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, forgotten)
+            self._invalidations += dropped
+        return dropped
+
+    def invalidate(self, task_ids: Iterable[int]) -> None:
+        """Drop the given tasks here and, with Postgres, in every other worker."""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return
+        self.discard(task_ids)
+        if self._listener is not None:
+            self._listener.publish(task_ids)
+
+    def invalidate_all(self) -> None:
+        """Drop every entry here and, with Postgres, in every other worker."""
+        self.clear()
+        if self._listener is not None:
+            self._listener.publish_clear()
+
+    def clear(self) -> None:
+        """Drop every entry in this process."""
+        with self._lock:
+            self._entries.clear()
+            self._variants.clear()
+            self._bytes = 0
+            self._generation += 1
+            self._floor = self._generation
+            self._invalidated.clear()
+
+    def stats(self) -> dict[str, float]:
+        """Return hit ratio, size and counters."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "cross_worker": self.cross_worker,
+            }
+
+    def start(self) -> None:
+        """Start listening for invalidations from other workers (Postgres only)."""
+        if database.get_engine().dialect.name != "postgresql" or self._listener is not None:
+            return
+        self._listener = _NotifyListener(self)
+        self._listener.start()
+
+    def stop(self) -> None:
+        """Stop the invalidation listener."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+class _NotifyListener:
+    """Publishes invalidations with NOTIFY and applies those from other workers via LISTEN."""
+
+    def __init__(self, cache: TaskCache, poll_interval: float = 1.0) -> None:
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def publish(self, task_ids: list[int]) -> None:
+        payloads, current = [], ""
+        for task_id in task_ids:
+            part = str(task_id)
+            if current and len(current) + len(part) + 1 > _NOTIFY_MAX_PAYLOAD:
+                payloads.append(current)
+                current = ""
+            current = f"{current},{part}" if current else part
+        payloads.append(current)
+        self._notify(payloads, len(task_ids))
+
+    def publish_clear(self) -> None:
+        self._notify([_CLEAR_ALL], None)
+
+    def _notify(self, payloads: list[str], count: Optional[int]) -> None:
+        try:
+            with database.get_engine().begin() as conn:
+                for payload in payloads:
+                    conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+        except Exception:  # noqa: BLE001
+            log.warning("task_cache: notify failed", extra={"count": count}, exc_info=True)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="task-cache-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:  # noqa: BLE001
+                log.warning("task_cache: listener disconnected", exc_info=True)
+            # Notifications may have been missed while disconnected.
+            self.connected.clear()
+            self.cache.clear()
+            self._stop.wait(self.poll_interval)
+
+    def _listen(self) -> None:
+        raw = database.get_engine().raw_connection()
+        try:
+            dbapi = raw.driver_connection
+            dbapi.autocommit = True
+            with dbapi.cursor() as cur:
+                cur.execute(f"LISTEN {CHANNEL}")
+            self.connected.set()
+            while not self._stop.is_set():
+                if select.select([dbapi], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                dbapi.poll()
+                task_ids: list[int] = []
+                clear = False
+                while dbapi.notifies:
+                    notify = dbapi.notifies.pop(0)
+                    if notify.payload == _CLEAR_ALL:
+                        clear = True
+                    else:
+                        task_ids.extend(int(part) for part in notify.payload.split(",") if part)
+                if clear:
+                    self.cache.clear()
+                elif task_ids:
+                    self.cache.discard(task_ids)
+        finally:
+            raw.invalidate()
+
+
+task_cache = TaskCache.from_env()
+
+
+def invalidate_tasks(task_ids: Iterable[int]) -> None:
+    """Invalidate cached responses for the given tasks, if the cache is enabled."""
+    if task_cache is not None:
+        task_cache.invalidate(task_ids)
+
+
+def invalidate_all_tasks() -> None:
+    """Drop every cached response in every worker, if the cache is enabled."""
+    if task_cache is not None:
+        task_cache.invalidate_all()
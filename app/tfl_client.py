@@ -1,15 +1,143 @@
 from __future__ import annotations
 
-from typing import Final
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Final, Optional, Protocol
 
-import requests
+from .schemas import lines_to_mask
+from .snapshots import SnapshotReader, SnapshotWriter
 
 BASE_URL: Final[str] = "https://api.tfl.gov.uk/Line"
 
+log = logging.getLogger(__name__)
+
+
+class Fetcher(Protocol):
+    """Backend that returns the disruptions payload for a line set."""
+
+    def fetch(self, lines: str) -> str: ...
+
+
+class LiveFetcher:
+    """Calls the TfL API."""
+
+    def fetch(self, lines: str) -> str:
+        import requests  # deferred: replay mode never needs it
+
+        url = f"{BASE_URL}/{lines}/Disruption"
+        resp = requests.get(url, timeout=10)
+        resp.raise_for_status()
+        return resp.text
+
+
+class RecordingFetcher:
+    """Fetches through another backend and appends every response to a snapshot file.
+
+    Args:
+        inner: Backend that produces the responses (normally LiveFetcher).
+        writer: Snapshot file to append to.
+    """
+
+    def __init__(self, inner: Fetcher, writer: SnapshotWriter) -> None:
+        self.inner = inner
+        self.writer = writer
+
+    def fetch(self, lines: str) -> str:
+        payload = self.inner.fetch(lines)
+        self.writer.append(lines_to_mask(lines), payload)
+        return payload
+
+
+class ReplayFetcher:
+    """Serves recorded responses instead of calling TfL.
+
+    With `speed` 0 (full speed), each call for a line set returns its next
+    recording in time order, wrapping around at the end. With a positive
+    `speed`, a replay clock starts at the first recording and runs `speed`
+    times faster than real time; each call returns the latest recording for
+    the line set as of that clock.
+
+    Args:
+        reader: Snapshot file to serve from.
+        speed: 0 for full speed, else the time-scaling factor (e.g. 60 replays an hour per minute).
+    """
+
+    def __init__(self, reader: SnapshotReader, speed: float = 0.0) -> None:
+        self.reader = reader
+        self.speed = speed
+        self._cursors: defaultdict[int, itertools.count] = defaultdict(itertools.count)
+        self._lock = threading.Lock()
+        self._origin = reader.time_range()[0] if len(reader) else 0.0
+        self._started = time.monotonic()
+
+    def replay_time(self) -> float:
+        """Current position of the replay clock (epoch seconds of the recording)."""
+        return self._origin + (time.monotonic() - self._started) * self.speed
+
+    def fetch(self, lines: str) -> str:
+        mask = lines_to_mask(lines)
+        if self.speed > 0:
+            return self.reader.at(mask, self.replay_time())
+        with self._lock:
+            n = next(self._cursors[mask])
+        return self.reader.nth(mask, n)
+
+
+_fetcher: Optional[Fetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def build_fetcher() -> Fetcher:
+    """Build the backend selected by TFL_FETCH_MODE (live, record or replay).
+
+    TFL_SNAPSHOT_PATH is the snapshot file (default `tfl_snapshots.bin`) and
+    TFL_REPLAY_SPEED the replay time scale (default 0 = full speed).
+
+    Raises:
+        ValueError: If TFL_FETCH_MODE is not recognised.
+    """
+    mode = os.getenv("TFL_FETCH_MODE", "live")
+    path = os.getenv("TFL_SNAPSHOT_PATH", "tfl_snapshots.bin")
+    if mode == "live":
+        return LiveFetcher()
+    if mode == "record":
+        log.info("tfl_client: recording responses", extra={"path": path})
+        return RecordingFetcher(LiveFetcher(), SnapshotWriter(path))
+    if mode == "replay":
+        reader = SnapshotReader(path)
+        speed = float(os.getenv("TFL_REPLAY_SPEED", "0"))
+        log.info("tfl_client: replaying responses", extra={"path": path, "records": len(reader), "speed": speed})
+        return ReplayFetcher(reader, speed=speed)
+    raise ValueError(f"Unknown TFL_FETCH_MODE: {mode!r}")
+
+
+def get_fetcher() -> Fetcher:
+    """Return the process-wide fetcher backend, building it on first call."""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = build_fetcher()
+    return _fetcher
+
+
+def set_fetcher(fetcher: Optional[Fetcher]) -> None:
+    """Replace the fetcher backend; None rebuilds it from the environment on next use."""
+    global _fetcher
+    with _fetcher_lock:
+        _fetcher = fetcher
+
 
 def fetch_disruptions(lines: str) -> str:
     """Fetch disruptions for the given tube line IDs from TfL API.
 
+    Served by the backend selected with TFL_FETCH_MODE: the live API, the live
+    API while recording to a snapshot file, or a replay of that file.
+
     Args:
         lines: Comma-separated tube line IDs (e.g., "victoria,central").
 
@@ -19,8 +147,6 @@ def fetch_disruptions(lines: str) -> str:
     Raises:
         requests.HTTPError: If the TfL API returns a non-success status code.
         requests.RequestException: For other network-level failures.
+        LookupError: In replay mode, if the line set was never recorded.
     """
-    url = f"{BASE_URL}/{lines}/Disruption"
-    resp = requests.get(url, timeout=10)
-    resp.raise_for_status()
-    return resp.text
+    return get_fetcher().fetch(lines)
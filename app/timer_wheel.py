@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Hashable, Optional
+
+log = logging.getLogger(__name__)
+
+_OVERFLOW = -1
+
+
+class TimerWheel:
+    """Hierarchical timing wheel for one-shot timers.
+
+    Level 0 has `slots` buckets of one tick each; every higher level has
+    `slots` buckets each spanning a full rotation of the level below. A timer
+    is stored at the lowest level whose enclosing block also contains the
+    current tick, and is cascaded one level down when the clock enters its
+    bucket. Timers beyond the top level wait in an overflow bucket.
+
+    Insert and cancel are O(1); advancing costs O(1) per tick plus the
+    timers that cascade or fire. Not thread-safe; callers hold a lock.
+
+    Args:
+        tick: Tick length in seconds (the scheduling precision).
+        slots: Buckets per level.
+        levels: Number of levels.
+        now: Start time (epoch seconds); defaults to time.time().
+    """
+
+    def __init__(self, tick: float = 0.1, slots: int = 256, levels: int = 4, now: Optional[float] = None) -> None:
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self._spans = [slots**level for level in range(levels + 1)]
+        self._buckets: list[list[dict[Hashable, float]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._overflow: dict[Hashable, float] = {}
+        self._due: dict[Hashable, float] = {}
+        self._where: dict[Hashable, tuple[int, int]] = {}
+        self._current = self._tick_of(time.time() if now is None else now)
+
+    def __len__(self) -> int:
+        return len(self._where) + len(self._due)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where or key in self._due
+
+    def _tick_of(self, when: float) -> int:
+        return int(when // self.tick)
+
+    def _place(self, key: Hashable, deadline: float) -> None:
+        target = self._tick_of(deadline)
+        if target <= self._current:
+            self._due[key] = deadline
+            return
+        for level in range(self.levels):
+            if target // self._spans[level + 1] == self._current // self._spans[level + 1]:
+                index = (target // self._spans[level]) % self.slots
+                self._buckets[level][index][key] = deadline
+                self._where[key] = (level, index)
+                return
+        self._overflow[key] = deadline
+        self._where[key] = (_OVERFLOW, 0)
+
+    def insert(self, key: Hashable, deadline: float) -> None:
+        """Add or replace the timer for `key`, firing at `deadline` (epoch seconds)."""
+        self.cancel(key)
+        self._place(key, deadline)
+
+    def cancel(self, key: Hashable) -> bool:
+        """Remove the timer for `key`. Returns True if one was pending."""
+        if self._due.pop(key, None) is not None:
+            return True
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        level, index = where
+        bucket = self._overflow if level == _OVERFLOW else self._buckets[level][index]
+        del bucket[key]
+        return True
+
+    def _cascade(self, bucket: dict[Hashable, float]) -> None:
+        entries = list(bucket.items())
+        bucket.clear()
+        for key, deadline in entries:
+            del self._where[key]
+            self._place(key, deadline)
+
+    def advance(self, now: float) -> list[tuple[Hashable, float]]:
+        """Move the clock to `now` and return the timers that became due.
+
+        Returns:
+            list[tuple[Hashable, float]]: (key, deadline) pairs, in no particular order.
+        """
+        target = self._tick_of(now)
+        while self._current < target:
+            self._current += 1
+            # Cascade from the highest level whose boundary was crossed downwards.
+            for level in range(self.levels, 0, -1):
+                if self._current % self._spans[level] == 0:
+                    if level == self.levels:
+                        self._cascade(self._overflow)
+                    else:
+                        self._cascade(self._buckets[level][(self._current // self._spans[level]) % self.slots])
+            bucket = self._buckets[0][self._current % self.slots]
+            for key, deadline in bucket.items():
+                del self._where[key]
+                self._due[key] = deadline
+            bucket.clear()
+
+        due, self._due = list(self._due.items()), {}
+        return due
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the wheel's containers (excluding keys)."""
+        total = sys.getsizeof(self._buckets) + sys.getsizeof(self._where) + sys.getsizeof(self._due)
+        total += sys.getsizeof(self._overflow)
+        for level in self._buckets:
+            total += sys.getsizeof(level) + sum(sys.getsizeof(bucket) for bucket in level)
+        return total
+
+
+class WheelScheduler:
+    """Scheduler backend that fires one-shot task runs from a TimerWheel.
+
+    A single thread advances the wheel every tick and hands due task IDs to
+    per-priority worker pools in batches. When more tasks are due than fit in
+    a batch, higher-priority classes (earlier in `workers`) go first and the
+    rest wait in a backlog for the next tick.
+
+    Args:
+        run: Callable executed with (task ID, priority) when a timer fires.
+        tick: Tick length in seconds.
+        workers: Worker pool size per priority class, most urgent first.
+        batch_size: Maximum task IDs handed to the pools per wake-up.
+        on_submit: Optional callback with the priority of each run handed to a pool.
+    """
+
+    def __init__(
+        self,
+        run: Callable[[int, str], None],
+        tick: float = 0.1,
+        workers: Optional[dict[str, int]] = None,
+        batch_size: int = 256,
+        on_submit: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.run = run
+        self.tick = tick
+        self.batch_size = batch_size
+        self.workers = workers or {"normal": 10}
+        self.on_submit = on_submit
+        self._default_priority = "normal" if "normal" in self.workers else next(iter(self.workers))
+        self._rank = {priority: rank for rank, priority in enumerate(self.workers)}
+        self._wheel = TimerWheel(tick=tick)
+        self._priority: dict[int, str] = {}
+        self._backlog: dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executors: dict[str, ThreadPoolExecutor] = {}
+        self._fired = 0
+        self._lateness_total = 0.0
+        self._lateness_max = 0.0
+
+    def schedule(self, task_id: int, run_at: datetime, priority: Optional[str] = None) -> None:
+        """Schedule (or reschedule) `task_id` to run at `run_at` in the given priority class."""
+        with self._lock:
+            self._backlog.pop(task_id, None)
+            self._priority[task_id] = priority if priority in self._rank else self._default_priority
+            self._wheel.insert(task_id, run_at.timestamp())
+
+    def cancel(self, task_id: int) -> bool:
+        """Cancel a pending run. Returns True if one was pending."""
+        with self._lock:
+            self._priority.pop(task_id, None)
+            in_backlog = self._backlog.pop(task_id, None) is not None
+            return self._wheel.cancel(task_id) or in_backlog
+
+    def start(self) -> None:
+        """Start the ticking thread and worker pools."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executors = {
+            priority: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"wheel-{priority}")
+            for priority, size in self.workers.items()
+        }
+        self._thread = threading.Thread(target=self._loop, name="timer-wheel", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop ticking and shut down the worker pools."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
+        self._executors = {}
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.tick):
+            self.dispatch_due(time.time())
+
+    def dispatch_due(self, now: float) -> int:
+        """Submit up to `batch_size` due tasks to their pools, most urgent class first.
+
+        Returns:
+            int: Number of tasks submitted.
+        """
+        with self._lock:
+            self._backlog.update(self._wheel.advance(now))
+            if len(self._backlog) <= self.batch_size:
+                selected = list(self._backlog.items())
+            else:
+                selected = sorted(
+                    self._backlog.items(),
+                    key=lambda item: (self._rank[self._priority.get(item[0], self._default_priority)], item[1]),
+                )[: self.batch_size]
+            batch = []
+            for task_id, deadline in selected:
+                del self._backlog[task_id]
+                batch.append((task_id, deadline, self._priority.pop(task_id, self._default_priority)))
+
+        for task_id, deadline, priority in batch:
+            lateness = max(0.0, now - deadline)
+            self._fired += 1
+            self._lateness_total += lateness
+            self._lateness_max = max(self._lateness_max, lateness)
+            executor = self._executors.get(priority)
+            if executor is None:
+                self.run(task_id, priority)
+                continue
+            if self.on_submit is not None:
+                self.on_submit(priority)
+            executor.submit(self._run_safely, task_id, priority)
+        return len(batch)
+
+    def _run_safely(self, task_id: int, priority: str) -> None:
+        try:
+            self.run(task_id, priority)
+        except Exception:  # noqa: BLE001
+            log.exception("timer_wheel: task run failed", extra={"task_id": task_id})
+
+    def stats(self) -> dict[str, float]:
+        """Return pending count, memory and firing lateness (ms) statistics."""
+        with self._lock:
+            pending = len(self._wheel) + len(self._backlog)
+            memory = self._wheel.memory_bytes() + sys.getsizeof(self._priority) + sys.getsizeof(self._backlog)
+        return {
+            "pending": pending,
+            "fired": self._fired,
+            "memory_bytes": memory,
+            "lateness_avg_ms": round(self._lateness_total / self._fired * 1000, 3) if self._fired else 0.0,
+            "lateness_max_ms": round(self._lateness_max * 1000, 3),
+        }
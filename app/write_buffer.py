@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.sql import Update
+
+from .database import SessionLocal
+from .models import Task
+from .task_cache import invalidate_tasks
+
+log = logging.getLogger(__name__)
+
+_tasks = Task.__table__
+
+
+@lru_cache(maxsize=None)
+def _update_statement(columns: tuple[str, ...], claimed: bool = False) -> Update:
+    """executemany UPDATE setting exactly `columns`, keyed by `b_id`.
+
+    Writes are grouped by the columns they set, so a status-only transition
+    (e.g. 'running') never clobbers a stored result. With `claimed`, rows are
+    only updated while still 'running' under the claim token `b_expected_claim`.
+    """
+    stmt = update(_tasks).where(_tasks.c.id == bindparam("b_id"))
+    if claimed:
+        stmt = stmt.where(_tasks.c.status == "running", _tasks.c.claim_token == bindparam("b_expected_claim"))
+    return stmt.values({name: bindparam(f"b_{name}") for name in columns})
+
+
+@dataclass
+class PendingWrite:
+    """Latest buffered transition for a single task.
+
+    Attributes:
+        values: Column values to write (always includes 'status').
+        attempts: Number of failed flushes this write has been part of.
+        retry_at: `time.monotonic()` before which a failed write is not retried.
+        claim_token: If set, the write only lands while the task is still
+            'running' under this claim (see `crud.claim_task`).
+    """
+
+    values: dict[str, Any] = field(default_factory=dict)
+    attempts: int = 0
+    retry_at: float = 0.0
+    claim_token: Optional[str] = None
+
+
+class StatusWriteBuffer:
+    """Write-behind buffer that batches task status transitions.
+
+    Transitions are coalesced per task (the latest one wins) and written in
+    one transaction per flush using executemany UPDATEs. A flush happens every
+    `flush_interval` seconds, or sooner once `max_size` tasks are pending.
+
+    Until a flush succeeds the database keeps the task's previous status, so a
+    crash can only lose progress, never record a result that was not produced.
+    Writes from a failed flush stay buffered and are retried with exponential
+    backoff (capped at `max_backoff` seconds). After `max_retries` failures the
+    tasks are re-marked 'scheduled' and rescheduled so they run again; while
+    even that fails (e.g. the database is down) the writes are kept and retried.
+    """
+
+    def __init__(
+        self, flush_interval: float = 0.5, max_size: int = 500, max_retries: int = 3, max_backoff: float = 30.0
+    ) -> None:
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._pending: dict[int, PendingWrite] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["StatusWriteBuffer"]:
+        """Build a buffer from environment variables, or None if disabled.
+
+        Reads TASK_WRITE_BEHIND ("1" enables), TASK_WRITE_BEHIND_INTERVAL
+        (seconds) and TASK_WRITE_BEHIND_MAX (pending tasks before a flush).
+        """
+        if os.getenv("TASK_WRITE_BEHIND") != "1":
+            return None
+        return cls(
+            flush_interval=float(os.getenv("TASK_WRITE_BEHIND_INTERVAL", "0.5")),
+            max_size=int(os.getenv("TASK_WRITE_BEHIND_MAX", "500")),
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def record(
+        self,
+        task_id: int,
+        status: str,
+        result: Optional[str] = None,
+        *,
+        claim_token: Optional[str] = None,
+        **columns: Any,
+    ) -> None:
+        """Buffer a status transition (and optional result) for a task.
+
+        Values not given keep whatever an earlier pending write for the task set.
+
+        Args:
+            task_id: Identifier of the task.
+            status: New status.
+            result: Result payload; None leaves the stored result untouched.
+            claim_token: Claim the run holds; the write is dropped at flush time
+                if the task was handed back or claimed by another run since, and
+                the claim is released when it lands.
+            **columns: Other task columns to write with the transition.
+        """
+        values: dict[str, Any] = {"status": status, **columns}
+        if result is not None:
+            values["result"] = result
+        if claim_token is not None:
+            values.update(lease_until=None, claim_token=None)
+        with self._lock:
+            previous = self._pending.get(task_id)
+            if previous is not None:
+                values = {**previous.values, **values}
+                claim_token = claim_token or previous.claim_token
+            self._pending[task_id] = PendingWrite(values=values, claim_token=claim_token)
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self, force: bool = False) -> int:
+        """Write all pending transitions that are not backing off in a single transaction.
+
+        Args:
+            force: Also write transitions that are backing off after a failed flush.
+
+        Returns:
+            int: Number of tasks written (0 if nothing was due or the flush failed).
+        """
+        with self._flush_lock:
+            now = time.monotonic()
+            with self._lock:
+                batch = {task_id: write for task_id, write in self._pending.items() if force or write.retry_at <= now}
+                for task_id in batch:
+                    del self._pending[task_id]
+            if not batch:
+                return 0
+
+            # Change-feed timestamps are taken at write time, so the feed cursor
+            # never skips a buffered write that lands after later direct ones.
+            flushed_at = datetime.now()
+            groups: dict[tuple[tuple[str, ...], bool], list[dict[str, Any]]] = {}
+            for task_id, write in batch.items():
+                columns = tuple(sorted(write.values))
+                params = {f"b_{name}": value for name, value in write.values.items()}
+                if params.get("b_changed_at") is not None:
+                    params["b_changed_at"] = flushed_at
+                params["b_id"] = task_id
+                if write.claim_token is not None:
+                    params["b_expected_claim"] = write.claim_token
+                groups.setdefault((columns, write.claim_token is not None), []).append(params)
+
+            db = SessionLocal()
+            try:
+                dropped = 0
+                for (columns, claimed), rows in groups.items():
+                    result = db.execute(_update_statement(columns, claimed), rows)
+                    if claimed and db.get_bind().dialect.supports_sane_multi_rowcount:
+                        # Runs handed back or re-claimed since: their results are dropped.
+                        dropped += len(rows) - result.rowcount
+                db.commit()
+            except Exception:  # noqa: BLE001
+                db.rollback()
+                log.exception("write_buffer: flush failed", extra={"count": len(batch)})
+                self._requeue(batch)
+                return 0
+            finally:
+                db.close()
+
+            invalidate_tasks(batch)
+            if dropped:
+                log.warning("write_buffer: dropped results of lost claims", extra={"count": dropped})
+            log.debug("write_buffer: flushed", extra={"count": len(batch)})
+            return len(batch)
+
+    def _requeue(self, batch: dict[int, PendingWrite]) -> None:
+        """Put writes from a failed flush back with backoff, unless a newer write superseded them.
+
+        Writes that have failed `max_retries` times are dropped only once their
+        tasks have been re-marked 'scheduled' and rescheduled.
+        """
+        now = time.monotonic()
+        exhausted: dict[int, PendingWrite] = {}
+        with self._lock:
+            for task_id, write in batch.items():
+                if task_id in self._pending:
+                    continue
+                write.attempts += 1
+                write.retry_at = now + min(self.max_backoff, self.flush_interval * 2**write.attempts)
+                self._pending[task_id] = write
+                if write.attempts > self.max_retries:
+                    exhausted[task_id] = write
+        if exhausted:
+            self._mark_for_retry(exhausted)
+
+    def _mark_for_retry(self, writes: dict[int, PendingWrite]) -> None:
+        """Reset and reschedule tasks whose results could not be persisted.
+
+        Tasks written under a claim are only reset while that claim still holds
+        them. If the reset fails too, the writes stay buffered and the next
+        failed flush tries again.
+        """
+        from .scheduler import schedule_task  # deferred: the scheduler imports this module
+
+        task_ids = list(writes)
+        claimed = [{"b_id": i, "b_expected_claim": w.claim_token} for i, w in writes.items() if w.claim_token]
+        unclaimed = [i for i, w in writes.items() if not w.claim_token]
+        db = SessionLocal()
+        try:
+            if claimed:
+                db.execute(
+                    _update_statement(("claim_token", "lease_until", "status"), True),
+                    [{**row, "b_status": "scheduled", "b_lease_until": None, "b_claim_token": None} for row in claimed],
+                )
+            if unclaimed:
+                db.execute(
+                    update(_tasks)
+                    .where(_tasks.c.id.in_(unclaimed), _tasks.c.status.in_(("scheduled", "running")))
+                    .values(status="scheduled", lease_until=None, claim_token=None)
+                )
+            db.commit()
+            tasks = db.scalars(select(Task).where(Task.id.in_(task_ids), Task.status == "scheduled")).all()
+        except Exception:  # noqa: BLE001
+            db.rollback()
+            log.exception("write_buffer: could not re-mark tasks", extra={"count": len(task_ids)})
+            return
+        finally:
+            db.close()
+
+        with self._lock:
+            for task_id in task_ids:
+                write = self._pending.get(task_id)
+                if write is not None and write.attempts > self.max_retries:
+                    del self._pending[task_id]
+        for task in tasks:
+            schedule_task(task)
+        log.warning(
+            "write_buffer: tasks re-marked for retry", extra={"count": len(task_ids), "rescheduled": len(tasks)}
+        )
+
+    def start(self) -> None:
+        """Start the background flusher thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="task-write-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the flusher thread and flush whatever is still pending."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush(force=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+write_buffer: Optional[StatusWriteBuffer] = StatusWriteBuffer.from_env()
@@ -0,0 +1,94 @@
+"""Measure cold-start cost: import time, startup hooks and time to first request.
+
+Each sample runs in a fresh interpreter, so nothing is cached in-process.
+With `--command`, the given server command is started instead and `--url` is
+polled until it answers, which measures a real gunicorn/uvicorn cold start.
+
+    PYTHONPATH=. poetry run python benchmarks/bench_startup.py --runs 5
+    PYTHONPATH=. poetry run python benchmarks/bench_startup.py \\
+        --command "gunicorn -c gunicorn.conf.py app.main:app" --url http://127.0.0.1:5555/tasks
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    t2 = time.perf_counter()
+    status = client.get("/tasks").status_code
+    t3 = time.perf_counter()
+heavy = [m for m in ("apscheduler", "requests", "jwt") if m in sys.modules]
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "startup_ms": (t2 - t1) * 1000,
+                  "first_request_ms": (t3 - t2) * 1000, "total_ms": (t3 - t0) * 1000,
+                  "status": status, "heavy_modules": heavy}))
+"""
+
+
+def bench_in_process(runs: int) -> None:
+    samples = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/bench.db", DISABLE_SCHEDULER="1")
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-c", _PROBE], env=env, capture_output=True, text=True, check=True)
+            samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"fresh interpreter, {runs} runs (median ms)")
+    for key in ("import_ms", "startup_ms", "first_request_ms", "total_ms"):
+        print(f"  {key:<18} {statistics.median(s[key] for s in samples):8.1f}")
+    print(f"  modules imported eagerly: {samples[-1]['heavy_modules'] or 'none'}")
+
+
+def bench_server(command: str, url: str, runs: int, timeout: float) -> None:
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(shlex.split(command), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                if time.perf_counter() - t0 > timeout:
+                    raise SystemExit(f"no response from {url} within {timeout}s")
+                try:
+                    with urllib.request.urlopen(url, timeout=1):
+                        break
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.02)
+            samples.append((time.perf_counter() - t0) * 1000)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print(f"time to first request for {command!r}, {runs} runs")
+    print(f"  median {statistics.median(samples):8.1f} ms   max {max(samples):8.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--command", help="server command to cold-start instead of the in-process probe")
+    parser.add_argument("--url", default="http://127.0.0.1:5555/tasks")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    if args.command:
+        bench_server(args.command, args.url, args.runs, args.timeout)
+    else:
+        bench_in_process(args.runs)
+
+
+if __name__ == "__main__":
+    main()
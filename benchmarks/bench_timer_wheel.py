@@ -0,0 +1,106 @@
+"""Compare the timing-wheel backend with APScheduler for many one-shot tasks.
+
+Measures insert/cancel cost and container memory for N future tasks, and the
+firing lateness of the wheel for a burst of near-term tasks.
+
+    PYTHONPATH=. poetry run python benchmarks/bench_timer_wheel.py --tasks 200000
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from app.timer_wheel import TimerWheel, WheelScheduler
+
+
+def _noop(task_id: int, priority: str = "normal") -> None:
+    pass
+
+
+def bench_wheel(n: int) -> None:
+    rng = random.Random(0)
+    now = time.time()
+    deadlines = [now + rng.uniform(1, 30 * 24 * 3600) for _ in range(n)]
+
+    tracemalloc.start()
+    wheel = TimerWheel(tick=0.1, now=now)
+    t0 = time.perf_counter()
+    for key, deadline in enumerate(deadlines):
+        wheel.insert(key, deadline)
+    insert_s = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for key in range(0, n, 2):
+        wheel.cancel(key)
+    cancel_s = time.perf_counter() - t0
+
+    print(
+        f"wheel        insert {insert_s / n * 1e6:7.2f} us/op  cancel {cancel_s / (n // 2) * 1e6:7.2f} us/op  "
+        f"traced peak {peak / 2**20:7.1f} MiB"
+    )
+
+
+def bench_apscheduler(n: int) -> None:
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.date import DateTrigger
+
+    rng = random.Random(0)
+    base = datetime.now()
+    run_dates = [base + timedelta(seconds=rng.uniform(60, 30 * 24 * 3600)) for _ in range(n)]
+
+    scheduler = BackgroundScheduler()
+    scheduler.start(paused=True)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    for key, run_date in enumerate(run_dates):
+        scheduler.add_job(_noop, DateTrigger(run_date=run_date), args=[key], id=str(key))
+    insert_s = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    for key in range(0, n, 2):
+        scheduler.remove_job(str(key))
+    cancel_s = time.perf_counter() - t0
+    scheduler.shutdown(wait=False)
+
+    print(
+        f"apscheduler  insert {insert_s / n * 1e6:7.2f} us/op  cancel {cancel_s / (n // 2) * 1e6:7.2f} us/op  "
+        f"traced peak {peak / 2**20:7.1f} MiB"
+    )
+
+
+def bench_precision(n: int, tick: float) -> None:
+    engine = WheelScheduler(_noop, tick=tick, workers={"normal": 4})
+    engine.start()
+    start = datetime.now()
+    for key in range(n):
+        engine.schedule(key, start + timedelta(seconds=1 + key * 2.0 / n))
+    time.sleep(3.5)
+    engine.shutdown()
+    stats = engine.stats()
+    print(
+        f"precision    tick {tick * 1000:.0f} ms  fired {stats['fired']}/{n}  "
+        f"lateness avg {stats['lateness_avg_ms']:.1f} ms  max {stats['lateness_max_ms']:.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tasks", type=int, default=50_000)
+    parser.add_argument("--skip-apscheduler", action="store_true")
+    args = parser.parse_args()
+
+    bench_wheel(args.tasks)
+    if not args.skip_apscheduler:
+        bench_apscheduler(args.tasks)
+    bench_precision(5_000, tick=0.1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,37 @@
 # Gunicorn config (Uvicorn workers)
 
 import multiprocessing
-workers = max(2, multiprocessing.cpu_count() * 2 + 1)
+import os
+
+workers = int(os.getenv("GUNICORN_WORKERS", max(2, multiprocessing.cpu_count() * 2 + 1)))
 worker_class = "uvicorn.workers.UvicornWorker"
 bind = "0.0.0.0:5555"
 timeout = 60
 graceful_timeout = 30
 keepalive = 5
 
+# GUNICORN_PRELOAD=1 imports the app once in the master and forks workers from
+# it, so new workers start serving without re-importing everything.
+preload_app = os.getenv("GUNICORN_PRELOAD") == "1"
+
 loglevel = "info"
 accesslog = "-"
 errorlog = "-"
+
+
+def on_starting(server):
+    """Create/upgrade the schema once in the master instead of in every worker."""
+    from app.database import dispose_engine, init_db
+
+    init_db()
+    # Workers inherit the environment and skip init_db on startup.
+    os.environ["DB_INIT_DONE"] = "1"
+    # Don't hand the master's connections to forked workers.
+    dispose_engine()
+
+
+def post_fork(server, worker):
+    """Forget any pooled connections inherited from the master (preload_app)."""
+    from app.database import dispose_engine
+
+    dispose_engine(close=False)
@@ -81,7 +81,7 @@ def test_update_only_when_scheduled(client) -> None:
 
     patch = client.patch(f"/tasks/{task_id}", json={"lines": "victoria,central"})
     assert patch.status_code == 200
-    assert patch.json()["lines"] == "victoria,central"
+    assert patch.json()["lines"] == "central,victoria"
 
 
 def test_delete_task(client) -> None:
@@ -121,4 +121,715 @@ def test_task_status_transitions_when_job_runs(client, monkeypatch) -> None:
     assert check.status_code == 200
     data: dict[str, Any] = check.json()
     assert data["status"] == "completed"
-    assert data["result"]
\ No newline at end of file
+    assert data["result"]
+
+def test_write_buffer_batches_transitions(client) -> None:
+    """
+    GIVEN two tasks with buffered 'running' and 'completed' transitions
+    WHEN the write-behind buffer is flushed
+    THEN both tasks are written in one flush with their final status and result.
+    """
+    from app.write_buffer import StatusWriteBuffer
+
+    ids = [client.post("/tasks", json={"lines": "victoria"}).json()["id"] for _ in range(2)]
+    buffer = StatusWriteBuffer(max_size=10)
+    for task_id in ids:
+        buffer.record(task_id, "running")
+        buffer.record(task_id, "completed", json.dumps([{"task": task_id}]))
+
+    assert len(buffer) == 2
+    assert client.get(f"/tasks/{ids[0]}").json()["status"] == "scheduled"
+    assert buffer.flush() == 2
+
+    for task_id in ids:
+        data = client.get(f"/tasks/{task_id}").json()
+        assert data["status"] == "completed"
+        assert json.loads(data["result"]) == [{"task": task_id}]
+
+
+def test_write_buffer_requeues_on_flush_failure(client, monkeypatch) -> None:
+    """
+    GIVEN a buffered transition and a database that rejects the flush
+    WHEN the flush fails
+    THEN the write is kept and backs off, and is written once the DB recovers.
+    """
+    from app import write_buffer as wb
+
+    task_id = client.post("/tasks", json={"lines": "central"}).json()["id"]
+    buffer = wb.StatusWriteBuffer()
+    buffer.record(task_id, "completed", "[]")
+
+    class BrokenSession:
+        def execute(self, *args, **kwargs):
+            raise RuntimeError("db down")
+
+        def rollback(self) -> None:
+            pass
+
+        def close(self) -> None:
+            pass
+
+    monkeypatch.setattr(wb, "SessionLocal", BrokenSession)
+    assert buffer.flush() == 0
+    assert len(buffer) == 1
+
+    monkeypatch.setattr(wb, "SessionLocal", SessionLocal)
+    assert buffer.flush() == 0
+    assert len(buffer) == 1
+    assert buffer.flush(force=True) == 1
+    assert client.get(f"/tasks/{task_id}").json()["status"] == "completed"
+
+
+def test_write_buffer_reschedules_tasks_after_max_retries(client, monkeypatch) -> None:
+    """
+    GIVEN a buffered 'completed' write for a running task that every flush fails to write
+    WHEN the database is also down, and then only the batched write keeps failing
+    THEN the write stays buffered while the task cannot be reset, and once it can
+         the task is re-marked 'scheduled', rescheduled and the write dropped.
+    """
+    from sqlalchemy import update
+    from app import scheduler
+    from app import write_buffer as wb
+
+    task_id = client.post("/tasks", json={"lines": "central"}).json()["id"]
+    db = SessionLocal()
+    try:
+        db.execute(update(models.Task).where(models.Task.id == task_id).values(status="running"))
+        db.commit()
+    finally:
+        db.close()
+
+    rescheduled: list[int] = []
+    monkeypatch.setattr(scheduler, "schedule_task", lambda task: rescheduled.append(task.id))
+
+    def failing_statement(columns):
+        raise RuntimeError("write rejected")
+
+    monkeypatch.setattr(wb, "_update_statement", failing_statement)
+    buffer = wb.StatusWriteBuffer(max_retries=2)
+    buffer.record(task_id, "completed", "[]")
+
+    class BrokenSession:
+        def execute(self, *args, **kwargs):
+            raise RuntimeError("db down")
+
+        def rollback(self) -> None:
+            pass
+
+        def close(self) -> None:
+            pass
+
+    monkeypatch.setattr(wb, "SessionLocal", BrokenSession)
+    for _ in range(4):
+        assert buffer.flush(force=True) == 0
+    assert len(buffer) == 1
+    assert rescheduled == []
+
+    monkeypatch.setattr(wb, "SessionLocal", SessionLocal)
+    assert buffer.flush(force=True) == 0
+    assert len(buffer) == 0
+    assert rescheduled == [task_id]
+    assert client.get(f"/tasks/{task_id}").json()["status"] == "scheduled"
+
+
+def test_get_task_conditional_request(client, monkeypatch) -> None:
+    """
+    GIVEN a task fetched once with its ETag
+    WHEN the client revalidates with If-None-Match / If-Modified-Since
+    THEN the service answers 304 until the task changes, and completed tasks
+         are marked immutable in Cache-Control.
+    """
+    from sqlalchemy import update
+    from app import scheduler
+    monkeypatch.setattr(scheduler, "fetch_disruptions", lambda lines: "[]")
+
+    task_id = client.post("/tasks", json={"lines": "victoria"}).json()["id"]
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.Task)
+            .where(models.Task.id == task_id)
+            .values(updated_at=datetime.now() - timedelta(seconds=5), version=models.Task.version)
+        )
+        db.commit()
+    finally:
+        db.close()
+    first = client.get(f"/tasks/{task_id}")
+    etag = first.headers["etag"]
+    assert "no-cache" in first.headers["cache-control"]
+
+    again = client.get(f"/tasks/{task_id}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+
+    since = client.get(f"/tasks/{task_id}", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert since.status_code == 304
+
+    run_task(task_id)
+
+    changed = client.get(f"/tasks/{task_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert "immutable" in changed.headers["cache-control"]
+    changed_since = client.get(f"/tasks/{task_id}", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert changed_since.status_code == 200
+    assert changed_since.json()["status"] == "completed"
+
+
+def test_list_tasks_conditional_request(client) -> None:
+    """
+    GIVEN the task list fetched once with its ETag
+    WHEN the client revalidates before and after a new task is created
+    THEN the service answers 304 first and 200 with a new ETag afterwards.
+    """
+    client.post("/tasks", json={"lines": "victoria"})
+    etag = client.get("/tasks").headers["etag"]
+
+    assert client.get("/tasks", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/tasks", json={"lines": "central"})
+    resp = client.get("/tasks", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["etag"] != etag
+
+
+def test_unconditional_reads_skip_the_validator_queries(client, monkeypatch) -> None:
+    """
+    GIVEN requests without If-None-Match / If-Modified-Since
+    WHEN a task and the (filtered) task list are fetched
+    THEN no validator-only query runs, and the ETags returned still answer 304
+         when the client revalidates with them.
+    """
+    task_id = client.post("/tasks", json={"lines": "victoria"}).json()["id"]
+    client.post("/tasks", json={"lines": "jubilee"})
+
+    def no_meta(*args, **kwargs):
+        raise AssertionError("validator query on an unconditional request")
+
+    with monkeypatch.context() as m:
+        m.setattr(crud, "get_task_meta", no_meta)
+        m.setattr(crud, "get_tasks_meta", no_meta)
+        task_etag = client.get(f"/tasks/{task_id}").headers["etag"]
+        list_etag = client.get("/tasks").headers["etag"]
+        filtered_etag = client.get("/tasks", params={"lines": "victoria"}).headers["etag"]
+
+    assert client.get(f"/tasks/{task_id}", headers={"If-None-Match": task_etag}).status_code == 304
+    assert client.get("/tasks", headers={"If-None-Match": list_etag}).status_code == 304
+    filtered = client.get("/tasks", params={"lines": "victoria"}, headers={"If-None-Match": filtered_etag})
+    assert filtered.status_code == 304
+
+
+def test_raw_result_format_and_compression(client, monkeypatch) -> None:
+    """
+    GIVEN a completed task with a large JSON result
+    WHEN the client requests it with result_format=raw and Accept-Encoding: gzip
+    THEN the result is embedded as JSON (not a string) and the body is gzip-encoded.
+    """
+    from app import scheduler
+    disruptions = [{"description": "Minor delays " * 20, "n": i} for i in range(20)]
+    monkeypatch.setattr(scheduler, "fetch_disruptions", lambda lines: json.dumps(disruptions))
+
+    task_id = client.post("/tasks", json={"lines": "victoria"}).json()["id"]
+    run_task(task_id)
+
+    raw = client.get(f"/tasks/{task_id}?result_format=raw", headers={"Accept-Encoding": "gzip"})
+    assert raw.status_code == 200
+    assert raw.headers["content-encoding"] == "gzip"
+    assert raw.headers["etag"].startswith("W/")
+    assert raw.json()["result"] == disruptions
+
+    plain = client.get(f"/tasks/{task_id}", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert json.loads(plain.json()["result"]) == disruptions
+
+
+def test_retention_clears_and_deletes_old_tasks(client, tmp_path) -> None:
+    """
+    GIVEN completed tasks scheduled 40 and 10 days ago, and a scheduled future task
+    WHEN retention runs with result_days=7 and delete_days=30 in small batches
+    THEN the 40-day-old task is archived and deleted, the 10-day-old one keeps
+         its status but loses its result, and the future task is untouched.
+    """
+    import gzip
+    from app.retention import RetentionPolicy, apply_retention
+
+    now = datetime.now().replace(microsecond=0)
+    db = SessionLocal()
+    try:
+        old = models.Task(schedule_time=now - timedelta(days=40), lines="victoria", status="completed", result="[1]")
+        recent = models.Task(schedule_time=now - timedelta(days=10), lines="central", status="completed", result="[2]")
+        future = models.Task(schedule_time=now + timedelta(days=1), lines="jubilee", status="scheduled")
+        db.add_all([old, recent, future])
+        db.commit()
+        ids = (old.id, recent.id, future.id)
+    finally:
+        db.close()
+
+    policy = RetentionPolicy(result_days=7, delete_days=30, archive_dir=tmp_path, batch_size=1, batch_pause=0)
+    report = apply_retention(policy, now=now)
+
+    assert report.deleted >= 1
+    assert report.results_cleared >= 1
+    assert client.get(f"/tasks/{ids[0]}").status_code == 404
+    recent_out = client.get(f"/tasks/{ids[1]}").json()
+    assert recent_out["status"] == "completed" and recent_out["result"] is None
+    assert client.get(f"/tasks/{ids[2]}").json()["status"] == "scheduled"
+
+    archived = [json.loads(line) for f in tmp_path.glob("*.jsonl.gz") for line in gzip.open(f)]
+    assert {"id": ids[0], "result": "[1]"}.items() <= next(r for r in archived if r["id"] == ids[0]).items()
+
+
+def test_retention_runs_only_in_the_lock_holder(client, tmp_path) -> None:
+    """
+    GIVEN a completed task past its retention and another process holding the retention lock
+    WHEN the scheduled retention job fires in this process
+    THEN it skips the pass, and runs it once the other process lets go of the lock.
+    """
+    from app.locks import ProcessLock
+    from app.retention import RetentionPolicy, retention_lock, run_retention
+
+    db = SessionLocal()
+    try:
+        old = models.Task(
+            schedule_time=datetime.now() - timedelta(days=40), lines="victoria", status="completed", result="[1]"
+        )
+        db.add(old)
+        db.commit()
+        task_id = old.id
+    finally:
+        db.close()
+
+    policy = RetentionPolicy(delete_days=30, archive_dir=tmp_path, batch_size=10, batch_pause=0)
+    other = ProcessLock("retention")
+    assert other.try_acquire()
+    try:
+        assert run_retention(policy) is None
+        assert client.get(f"/tasks/{task_id}").status_code == 200
+    finally:
+        other.release()
+
+    try:
+        report = run_retention(policy)
+    finally:
+        retention_lock.release()
+    assert report is not None and report.deleted >= 1
+    assert client.get(f"/tasks/{task_id}").status_code == 404
+
+
+def test_list_tasks_filtered_by_line(client) -> None:
+    """
+    GIVEN tasks for "victoria", "central,victoria" and "jubilee"
+    WHEN the client lists tasks with lines=victoria
+    THEN only tasks that include the victoria line are returned,
+         and an invalid line filter is rejected with HTTP 400.
+    """
+    ids = {
+        lines: client.post("/tasks", json={"lines": lines}).json()["id"]
+        for lines in ("victoria", "victoria,central", "jubilee")
+    }
+
+    resp = client.get("/tasks", params={"lines": "victoria"})
+    assert resp.status_code == 200
+    returned = {t["id"] for t in resp.json()}
+    assert {ids["victoria"], ids["victoria,central"]} <= returned
+    assert ids["jubilee"] not in returned
+    assert all("victoria" in t["lines"].split(",") for t in resp.json())
+
+    assert client.get("/tasks", params={"lines": "nope"}).status_code == 400
+
+
+def test_delta_mode_stores_diffs_and_feeds_changes(client, monkeypatch) -> None:
+    """
+    GIVEN delta mode and three runs for the same lines returning A, A, then A with one item changed
+    WHEN the tasks are read back and the changes feed is requested
+    THEN the second run is stored as 'same', the third as a delta, every read returns
+         the full result, only the changed runs are in the feed (in completion order,
+         including an earlier-created task that completes after the cursor moved),
+         and deleting the snapshot keeps the dependants readable.
+    """
+    import uuid
+    from app import deltas, scheduler
+
+    monkeypatch.setenv("RESULT_DELTA_MODE", "1")
+    monkeypatch.setenv("CHANGES_FEED_SETTLE_SECONDS", "0")
+    run_id = uuid.uuid4().hex
+    first = [{"id": f"{run_id}-{i}", "description": "Severe delays " * 5} for i in range(20)]
+    third = [dict(item) for item in first]
+    third[7]["description"] = "Good service"
+    later = [dict(item) for item in third]
+    later[0]["description"] = "Part closure"
+    payloads = iter([first, first, third, later])
+    monkeypatch.setattr(scheduler, "fetch_disruptions", lambda lines: json.dumps(next(payloads)))
+
+    lines = "hammersmith-city,waterloo-city"
+    tomorrow = (datetime.now() + timedelta(days=1)).replace(microsecond=0).isoformat()
+    due_tomorrow = client.post("/tasks", json={"lines": lines, "schedule_time": tomorrow}).json()["id"]
+    ids = []
+    for _ in range(3):
+        task_id = client.post("/tasks", json={"lines": lines}).json()["id"]
+        run_task(task_id)
+        ids.append(task_id)
+
+    db = SessionLocal()
+    try:
+        kinds = [db.get(models.Task, task_id).result_kind for task_id in ids]
+    finally:
+        db.close()
+    assert kinds == [deltas.FULL, deltas.SAME, deltas.DELTA]
+
+    outs = [client.get(f"/tasks/{task_id}").json() for task_id in ids]
+    assert [o["changed"] for o in outs] == [True, False, True]
+    assert [json.loads(o["result"]) for o in outs] == [first, first, third]
+
+    feed = client.get("/tasks/changes", params={"lines": lines})
+    assert [t["id"] for t in feed.json()] == [ids[0], ids[2]]
+    cursor = feed.headers["x-next-cursor"]
+
+    run_task(due_tomorrow)
+    page = client.get("/tasks/changes", params={"cursor": cursor, "lines": lines})
+    assert [t["id"] for t in page.json()] == [due_tomorrow]
+    assert client.get("/tasks/changes", params={"cursor": "nope"}).status_code == 400
+
+    assert client.delete(f"/tasks/{ids[0]}").status_code == 204
+    assert json.loads(client.get(f"/tasks/{ids[1]}").json()["result"]) == first
+    assert json.loads(client.get(f"/tasks/{ids[2]}").json()["result"]) == third
+
+
+def test_delta_mode_diffs_against_the_last_completed_result(client, monkeypatch) -> None:
+    """
+    GIVEN delta mode and three tasks for the same lines completing in reverse id order with X, Y, then X
+    WHEN the earliest-created task completes last
+    THEN it is diffed against Y, the result it replaced, so it is stored as changed and is in the feed.
+    """
+    import uuid
+    from app import scheduler
+
+    monkeypatch.setenv("RESULT_DELTA_MODE", "1")
+    monkeypatch.setenv("CHANGES_FEED_SETTLE_SECONDS", "0")
+    run_id = uuid.uuid4().hex
+    x = [{"id": f"{run_id}-{i}", "description": "Minor delays"} for i in range(5)]
+    y = [dict(item, description="Good service") for item in x]
+    payloads = iter([x, y, x])
+    monkeypatch.setattr(scheduler, "fetch_disruptions", lambda lines: json.dumps(next(payloads)))
+
+    lines = "bakerloo,district,piccadilly"
+    ids = [client.post("/tasks", json={"lines": lines}).json()["id"] for _ in range(3)]
+    for task_id in reversed(ids):
+        run_task(task_id)
+
+    last = client.get(f"/tasks/{ids[0]}").json()
+    assert last["changed"] is True
+    assert json.loads(last["result"]) == x
+    feed = client.get("/tasks/changes", params={"lines": lines}).json()
+    assert [t["id"] for t in feed] == [ids[2], ids[1], ids[0]]
+
+
+def test_create_task_admission_control(client, monkeypatch) -> None:
+    """
+    GIVEN a due queue deeper than the 'normal' admission limit
+    WHEN the client posts immediate tasks with normal and high priority, and a future task
+    THEN the normal one is refused with 429 and Retry-After, while the high-priority
+         and future tasks are accepted.
+    """
+    from app.admission import admission
+
+    monkeypatch.setattr(admission, "limits", {"high": 0, "normal": 2, "low": 1})
+    monkeypatch.setattr(admission, "_depth", {"high": 0, "normal": 5, "low": 0})
+
+    refused = client.post("/tasks", json={"lines": "victoria"})
+    assert refused.status_code == 429
+    assert int(refused.headers["retry-after"]) >= 1
+
+    urgent = client.post("/tasks", json={"lines": "victoria", "priority": "high"})
+    assert urgent.status_code == 201
+    assert urgent.json()["priority"] == "high"
+
+    run_at = (datetime.now() + timedelta(hours=1)).replace(microsecond=0).isoformat()
+    assert client.post("/tasks", json={"lines": "victoria", "schedule_time": run_at}).status_code == 201
+
+
+def test_drain_hands_back_in_flight_tasks_and_recovery_resets_orphans(client, monkeypatch) -> None:
+    """
+    GIVEN a task whose TfL fetch is still in flight, and another left 'running' by a dead worker
+    WHEN the process drains with a short deadline, and recovery runs on the next startup
+    THEN the in-flight task is handed back to 'scheduled', no new task is claimed
+         while draining, and the orphaned task is reset to 'scheduled'.
+    """
+    import threading
+    from sqlalchemy import update
+    from app import scheduler
+    from app.lifecycle import drain, recover_tasks
+
+    release = threading.Event()
+    entered = threading.Event()
+
+    def slow_fetch(lines: str) -> str:
+        entered.set()
+        release.wait(5)
+        return "[]"
+
+    monkeypatch.setattr(scheduler, "fetch_disruptions", slow_fetch)
+    busy_id = client.post("/tasks", json={"lines": "northern"}).json()["id"]
+    waiting_id = client.post("/tasks", json={"lines": "northern"}).json()["id"]
+    worker = threading.Thread(target=run_task, args=[busy_id])
+    worker.start()
+    try:
+        assert entered.wait(5)
+        report = drain(deadline=0.1)
+        assert report.handed_back == [busy_id]
+        assert client.get(f"/tasks/{busy_id}").json()["status"] == "scheduled"
+
+        run_task(waiting_id)
+        assert client.get(f"/tasks/{waiting_id}").json()["status"] == "scheduled"
+    finally:
+        release.set()
+        worker.join()
+        scheduler.draining.clear()
+
+    orphan_id = client.post("/tasks", json={"lines": "piccadilly"}).json()["id"]
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(models.Task)
+            .where(models.Task.id == orphan_id)
+            .values(status="running", updated_at=datetime.now() - timedelta(hours=1))
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    reset, _ = recover_tasks(stale_after=60)
+    assert reset >= 1
+    assert client.get(f"/tasks/{orphan_id}").json()["status"] == "scheduled"
+
+
+def test_replay_mode_runs_tasks_against_recorded_snapshots(client, tmp_path) -> None:
+    """
+    GIVEN TfL responses recorded to a snapshot file in record mode
+    WHEN tasks run with the fetcher in replay mode
+    THEN each run is served the next recording for its line set, in order,
+         and a line set that was never recorded fails the task.
+    """
+    from app import tfl_client
+    from app.snapshots import SnapshotReader, SnapshotWriter
+
+    class FakeLive:
+        def __init__(self) -> None:
+            self.calls = 0
+
+        def fetch(self, lines: str) -> str:
+            self.calls += 1
+            return json.dumps([{"lines": lines, "n": self.calls}])
+
+    path = tmp_path / "tfl.snap"
+    writer = SnapshotWriter(path)
+    recorder = tfl_client.RecordingFetcher(FakeLive(), writer)
+    try:
+        tfl_client.set_fetcher(recorder)
+        first = client.post("/tasks", json={"lines": "victoria,central"}).json()["id"]
+        second = client.post("/tasks", json={"lines": "central,victoria"}).json()["id"]
+        run_task(first)
+        run_task(second)
+        writer.close()
+
+        tfl_client.set_fetcher(tfl_client.ReplayFetcher(SnapshotReader(path)))
+        replayed = [client.post("/tasks", json={"lines": "victoria,central"}).json()["id"] for _ in range(3)]
+        for task_id in replayed:
+            run_task(task_id)
+        missing = client.post("/tasks", json={"lines": "jubilee"}).json()["id"]
+        run_task(missing)
+    finally:
+        tfl_client.set_fetcher(None)
+
+    results = [json.loads(client.get(f"/tasks/{task_id}").json()["result"]) for task_id in replayed]
+    assert [r[0]["n"] for r in results] == [1, 2, 1]
+    failed = client.get(f"/tasks/{missing}").json()
+    assert failed["status"] == "failed"
+    assert "LookupError" in failed["result"]
+
+
+def test_reads_go_to_replica_except_right_after_a_write(client, tmp_path, monkeypatch) -> None:
+    """
+    GIVEN a read replica that has not caught up with the primary yet
+    WHEN a client creates a task and reads it back, and reads again once the
+         read-your-writes window is over
+    THEN the writer's reads are served by the primary, later reads by the replica,
+         and per-pool metrics report both pools.
+    """
+    from sqlalchemy import create_engine
+    from app import database, replicas
+    from app.models import Base
+
+    replica_url = f"sqlite:///{tmp_path / 'replica.db'}"
+    Base.metadata.create_all(create_engine(replica_url))
+    monkeypatch.setenv("REPLICA_DATABASE_URL", replica_url)
+    monkeypatch.setattr(database, "_replica_engine", None)
+    try:
+        created = client.post("/tasks", json={"lines": "victoria"})
+        task_id = created.json()["id"]
+        assert replicas.STICKY_COOKIE in created.cookies
+
+        assert client.get(f"/tasks/{task_id}").status_code == 200
+
+        client.cookies.clear()
+        assert client.get(f"/tasks/{task_id}").status_code == 200  # task written recently
+
+        monkeypatch.setattr(replicas, "_recent_writes", {})
+        assert client.get(f"/tasks/{task_id}").status_code == 404
+        assert client.get("/tasks").json() == []
+
+        metrics = client.get("/metrics/db").json()
+        assert metrics["replica"]["checkouts"] >= 2
+        assert metrics["primary"]["checkouts"] >= 1
+    finally:
+        database.dispose_engine()
+        database._pool_metrics.pop("replica", None)
+
+
+def test_task_read_cache_serves_terminal_tasks_until_invalidated(client, monkeypatch) -> None:
+    """
+    GIVEN the in-process task cache is enabled and a task has completed
+    WHEN the task is read repeatedly, and then deleted
+    THEN repeat reads are served from the cache without touching the database,
+         the delete invalidates the entry, and the hit ratio is reported.
+    """
+    from sqlalchemy import update
+    from app import routes, scheduler, task_cache as tc
+
+    cache = tc.TaskCache()
+    monkeypatch.setattr(tc, "task_cache", cache)
+    monkeypatch.setattr(routes, "task_cache", cache)
+    monkeypatch.setattr(scheduler, "fetch_disruptions", lambda lines: '[{"ok": true}]')
+
+    task_id = client.post("/tasks", json={"lines": "victoria"}).json()["id"]
+    run_task(task_id)
+    first = client.get(f"/tasks/{task_id}")
+    assert first.json()["status"] == "completed"
+
+    db = SessionLocal()
+    try:
+        db.execute(update(models.Task).where(models.Task.id == task_id).values(result="[]"))
+        db.commit()
+    finally:
+        db.close()
+    second = client.get(f"/tasks/{task_id}")
+    assert second.content == first.content
+    assert client.get(f"/tasks/{task_id}", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    assert client.delete(f"/tasks/{task_id}").status_code == 204
+    assert client.get(f"/tasks/{task_id}").status_code == 404
+
+    stats = client.get("/metrics/task-cache").json()
+    assert stats["enabled"] is True
+    assert stats["hits"] == 2 and stats["invalidations"] >= 1
+
+
+def test_sweep_recovers_runs_whose_lease_expired(client) -> None:
+    """
+    GIVEN one run whose claiming process died (lease expired) and one still renewing its lease
+    WHEN the supervisor leader sweeps
+    THEN only the expired run is reset to 'scheduled' and put back on the scheduler,
+         and lease renewals do not change the live task's ETag.
+    """
+    from app import scheduler
+    from app.lifecycle import sweep_tasks
+
+    dead_id = client.post("/tasks", json={"lines": "victoria"}).json()["id"]
+    live_id = client.post("/tasks", json={"lines": "central"}).json()["id"]
+    db = SessionLocal()
+    try:
+        assert crud.claim_task(db, dead_id, lease_until=datetime.now() - timedelta(seconds=1))
+        assert crud.claim_task(db, live_id, lease_until=datetime.now() + timedelta(seconds=1))
+        etag = client.get(f"/tasks/{live_id}").headers["ETag"]
+        assert crud.renew_leases(db, [live_id], lease_until=datetime.now() + timedelta(seconds=60)) == 1
+    finally:
+        db.close()
+    assert client.get(f"/tasks/{live_id}").headers["ETag"] == etag
+
+    reset, _ = sweep_tasks()
+    assert reset == 1
+    assert client.get(f"/tasks/{dead_id}").json()["status"] == "scheduled"
+    assert client.get(f"/tasks/{live_id}").json()["status"] == "running"
+    assert scheduler.get_scheduler().get_job(str(dead_id)) is not None
+
+
+def test_handed_back_run_cannot_overwrite_the_next_claim(client, monkeypatch) -> None:
+    """
+    GIVEN a run that drain hands back while it is still fetching, and a second claim of the task
+    WHEN the stale run finishes, directly or through the write-behind buffer
+    THEN its result is dropped and the task stays 'running' under the second claim,
+         which can still complete it.
+    """
+    import threading
+    from app import scheduler
+    from app.write_buffer import StatusWriteBuffer
+
+    task_id = client.post("/tasks", json={"lines": "victoria"}).json()["id"]
+    fetching, release = threading.Event(), threading.Event()
+
+    def slow_fetch(lines: str) -> str:
+        fetching.set()
+        release.wait(5)
+        return '["stale"]'
+
+    monkeypatch.setattr(scheduler, "fetch_disruptions", slow_fetch)
+    monkeypatch.setattr(scheduler, "write_buffer", None)
+    stale = threading.Thread(target=scheduler.run_task, args=(task_id,))
+    stale.start()
+    assert fetching.wait(5)
+
+    db = SessionLocal()
+    try:
+        assert crud.release_tasks(db, [task_id]) == 1
+        claim = crud.claim_task(db, task_id)
+        assert claim
+        release.set()
+        stale.join(5)
+        data = client.get(f"/tasks/{task_id}").json()
+        assert data["status"] == "running" and data["result"] is None
+
+        buffer = StatusWriteBuffer()
+        buffer.record(task_id, "completed", '["stale"]', claim_token="lost-claim")
+        buffer.flush()
+        assert client.get(f"/tasks/{task_id}").json()["status"] == "running"
+
+        buffer.record(task_id, "completed", '["fresh"]', claim_token=claim)
+        buffer.flush()
+    finally:
+        db.close()
+    data = client.get(f"/tasks/{task_id}").json()
+    assert data["status"] == "completed" and json.loads(data["result"]) == ["fresh"]
+
+
+def test_admission_depth_returns_to_zero_after_real_scheduler_runs(client, monkeypatch) -> None:
+    """
+    GIVEN the real APScheduler with its per-priority pools
+    WHEN hundreds of immediately due runs are scheduled and all of them finish
+    THEN the admission depth is back to zero for every priority class.
+    """
+    import time
+    from types import SimpleNamespace
+    from app import scheduler
+    from app.admission import admission
+
+    monkeypatch.setattr(scheduler, "_scheduler", None)
+    monkeypatch.setattr(scheduler, "wheel", None)
+    finished = []
+    monkeypatch.setattr(scheduler, "run_task", lambda task_id: finished.append(task_id))
+    baseline = {p: admission.depth(p) for p in ("high", "normal", "low")}
+
+    aps = scheduler.get_scheduler()
+    aps.start()
+    try:
+        now = datetime.now()
+        for task_id in range(1, 401):
+            priority = ("high", "normal", "low")[task_id % 3]
+            scheduler.schedule_task(SimpleNamespace(id=10_000_000 + task_id, schedule_time=now, priority=priority))
+        deadline = time.monotonic() + 10
+        while len(finished) < 400 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        aps.shutdown(wait=True)
+
+    assert len(finished) == 400
+    assert {p: admission.depth(p) for p in ("high", "normal", "low")} == baseline
@@ -3,9 +3,323 @@ import pytest
 
 def test_normalized_lines_valid():
     t = TaskCreate(lines="victoria, central")
-    assert t.normalized_lines() == "victoria,central"
+    assert t.normalized_lines() == "central,victoria"
+
+def test_normalized_lines_canonical_and_mask_roundtrip():
+    from app.schemas import LINE_BITS, lines_to_mask, mask_to_lines, masks_containing
+
+    t = TaskCreate(lines=" Victoria,central ,victoria,")
+    assert t.normalized_lines() == "central,victoria"
+    mask = lines_to_mask("victoria,central")
+    assert mask == LINE_BITS["victoria"] | LINE_BITS["central"]
+    assert mask_to_lines(mask) == "central,victoria"
+    assert mask in masks_containing(LINE_BITS["victoria"])
+    assert LINE_BITS["jubilee"] not in masks_containing(LINE_BITS["victoria"])
+    assert len(masks_containing(LINE_BITS["victoria"])) == 2 ** (len(LINE_BITS) - 1)
 
 def test_normalized_lines_invalid():
     t = TaskCreate(lines="victoria, nope")
     with pytest.raises(ValueError):
         t.normalized_lines()
+
+
+def test_negotiate_prefers_client_quality_then_server_order():
+    from app.compression import negotiate
+
+    assert negotiate("gzip, br", ["zstd", "br", "gzip"]) == "br"
+    assert negotiate("gzip;q=1.0, br;q=0.5", ["br", "gzip"]) == "gzip"
+    assert negotiate("identity", ["gzip"]) is None
+    assert negotiate("*", ["zstd", "gzip"]) == "zstd"
+
+
+def test_dumps_embeds_raw_json_without_escaping(monkeypatch):
+    import json
+    from app import responses
+
+    payload = {"id": 1, "result": responses.RawJSON('[{"a": "b"}]')}
+    assert json.loads(responses.dumps(payload)) == {"id": 1, "result": [{"a": "b"}]}
+
+    monkeypatch.setattr(responses, "orjson", None)
+    assert responses.dumps(payload) == b'{"id":1,"result":[{"a": "b"}]}'
+
+
+def test_task_payload_returns_invalid_json_results_as_strings(monkeypatch):
+    import json
+    from datetime import datetime
+    from types import SimpleNamespace
+    from app import responses
+
+    task = SimpleNamespace(
+        id=1, schedule_time=datetime(2024, 1, 1), lines="victoria", status="completed", priority="normal", changed=None
+    )
+    for orjson in (responses.orjson, None):
+        monkeypatch.setattr(responses, "orjson", orjson)
+        task.result = '[{"a": 1}]'
+        assert json.loads(responses.dumps(responses.task_payload(task, "raw")))["result"] == [{"a": 1}]
+        task.result = "Service Unavailable"
+        assert json.loads(responses.dumps(responses.task_payload(task, "raw")))["result"] == "Service Unavailable"
+
+
+def test_timer_wheel_fires_each_timer_once_at_its_tick():
+    import random
+    from app.timer_wheel import TimerWheel
+
+    rng = random.Random(7)
+    wheel = TimerWheel(tick=1.0, slots=4, levels=3, now=0.0)
+    deadlines = {key: float(rng.randint(1, 200)) for key in range(300)}
+    for key, deadline in deadlines.items():
+        wheel.insert(key, deadline)
+    for key in range(0, 300, 3):
+        assert wheel.cancel(key)
+    assert not wheel.cancel(0)
+
+    fired: dict[int, float] = {}
+    for now in range(1, 201):
+        for key, _ in wheel.advance(float(now)):
+            assert key not in fired
+            fired[key] = now
+
+    expected = {k: d for k, d in deadlines.items() if k % 3}
+    assert fired == expected
+    assert len(wheel) == 0
+
+
+def test_wheel_scheduler_dispatches_due_tasks_in_priority_batches():
+    from datetime import datetime, timedelta
+    from app.timer_wheel import WheelScheduler
+
+    ran: list[int] = []
+    engine = WheelScheduler(lambda task_id, priority: ran.append(task_id), tick=0.01, batch_size=2,
+                            workers={"high": 1, "normal": 1, "low": 1})
+    past = datetime.now() - timedelta(seconds=1)
+    engine.schedule(1, past - timedelta(seconds=5), "low")
+    engine.schedule(2, past, "normal")
+    engine.schedule(3, past, "high")
+    engine.schedule(4, datetime.now() + timedelta(hours=1))
+
+    now = datetime.now().timestamp()
+    assert engine.dispatch_due(now) == 2
+    assert ran == [3, 2]
+    assert engine.dispatch_due(now) == 1
+    assert ran == [3, 2, 1]
+    assert engine.stats()["pending"] == 1
+    assert engine.cancel(4)
+
+
+def test_delta_diff_apply_roundtrip():
+    from app.deltas import apply, diff
+
+    base = [{"n": i} for i in range(10)]
+    new = [{"n": 0}, {"n": "x"}] + base[2:8] + [{"n": 99}]
+    ops = diff(base, new)
+    assert apply(base, ops) == new
+    assert diff(base, base) == [[0, 10]]
+
+
+def test_admission_refuses_by_priority_when_queue_is_deep():
+    from app.admission import AdmissionController
+
+    ctl = AdmissionController({"high": 0, "normal": 4, "low": 2}, {"high": 1, "normal": 1, "low": 1})
+    for _ in range(3):
+        ctl.submitted("low")
+    assert ctl.retry_after("high") is None
+    assert ctl.retry_after("normal") is None
+    assert ctl.retry_after("low") >= 1
+
+    ctl.submitted("normal")
+    assert ctl.retry_after("normal") >= 1
+    ctl.started("low")
+    assert ctl.retry_after("normal") is None
+
+
+def test_importing_app_defers_scheduler_client_and_engine():
+    import subprocess
+    import sys
+
+    probe = (
+        "import sys, app.main, app.database as d;"
+        "print(sorted(m for m in ('apscheduler', 'requests', 'jwt') if m in sys.modules), d._engine)"
+    )
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[] None"
+
+
+def test_snapshot_file_indexes_by_lines_and_time(tmp_path):
+    from app.snapshots import SnapshotReader, SnapshotWriter
+
+    path = tmp_path / "snap.bin"
+    writer = SnapshotWriter(path)
+    writer.append(1, '["a"]', timestamp=100.0)
+    writer.append(2, '["x"]', timestamp=105.0)
+    writer.append(1, '["b"]', timestamp=110.0)
+    writer.close()
+    with open(path, "ab") as fh:
+        fh.write(b"\x10\x00")  # torn trailing record is ignored
+
+    reader = SnapshotReader(path)
+    assert len(reader) == 3 and reader.count(1) == 2
+    assert reader.time_range() == (100.0, 110.0)
+    assert reader.at(1, 50.0) == '["a"]'
+    assert reader.at(1, 109.9) == '["a"]'
+    assert reader.at(1, 200.0) == '["b"]'
+    assert [reader.nth(1, n) for n in range(3)] == ['["a"]', '["b"]', '["a"]']
+    with pytest.raises(LookupError):
+        reader.at(4, 100.0)
+    reader.close()
+
+
+def test_snapshot_writers_sharing_a_new_file_write_one_header(tmp_path):
+    import threading
+    from app.snapshots import SnapshotReader, SnapshotWriter
+
+    for attempt in range(25):
+        path = tmp_path / f"shared-{attempt}.bin"
+        barrier = threading.Barrier(4)
+
+        def record(worker):
+            barrier.wait()
+            writer = SnapshotWriter(path)  # e.g. one per gunicorn worker
+            for _ in range(3):
+                writer.append(worker, str(worker) * 50_000)
+            writer.close()
+
+        threads = [threading.Thread(target=record, args=(worker,)) for worker in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        reader = SnapshotReader(path)
+        assert len(reader) == 12
+        assert all(reader.nth(worker, n) == str(worker) * 50_000 for worker in range(1, 5) for n in range(3))
+        reader.close()
+
+
+def test_task_cache_is_bounded_by_bytes_and_expires_non_terminal(monkeypatch):
+    from app import task_cache as tc
+
+    clock = [1000.0]
+    monkeypatch.setattr(tc.time, "monotonic", lambda: clock[0])
+    cache = tc.TaskCache(max_bytes=3 * (100 + tc._ENTRY_OVERHEAD), ttl=2, fallback_ttl=30)
+    meta = {"headers": {}, "etag": "e", "last_modified": None}
+    for task_id in (1, 2, 3):
+        cache.put(task_id, "", body=b"x" * 100, terminal=task_id != 3, **meta)
+    assert cache.get(1) is not None  # 1 is now most recently used
+    cache.put(4, "", body=b"x" * 100, terminal=True, **meta)
+    assert cache.get(2) is None  # least recently used, evicted by size
+    assert cache.stats()["evictions"] == 1
+
+    clock[0] += 5
+    assert cache.get(3) is None  # non-terminal, past ttl
+    assert cache.get(4) is not None  # terminal, within the fallback bound
+    cache.put(1, "raw", body=b"y", terminal=True, **meta)
+    assert cache.discard([1]) == 2
+    assert cache.stats()["hit_ratio"] == 0.5
+
+
+def test_task_cache_refuses_rows_read_before_an_invalidation():
+    import threading
+    from types import SimpleNamespace
+    from app import task_cache as tc
+
+    cache = tc.TaskCache()
+    meta = {"body": b"{}", "headers": {}, "etag": "e", "last_modified": None, "terminal": True}
+    before = cache.generation()
+    cache.discard([1])  # e.g. a delete in another worker lands during the read
+    cache.put(1, "", generation=before, **meta)
+    cache.put(2, "", generation=before, **meta)
+    assert cache.get(1) is None
+    assert cache.get(2) is not None
+
+    published = []
+    cache._listener = SimpleNamespace(publish_clear=lambda: published.append("*"), connected=threading.Event())
+    before = cache.generation()
+    cache.invalidate_all()
+    assert published == ["*"]
+    assert cache.get(2) is None
+    cache.put(2, "", generation=before, **meta)
+    assert cache.get(2) is None
+    cache.put(2, "", generation=cache.generation(), **meta)
+    assert cache.get(2) is not None
+
+
+def test_process_lock_elects_a_single_holder():
+    from app.locks import ProcessLock
+
+    first, second = ProcessLock("test-election"), ProcessLock("test-election")
+    assert first.try_acquire()
+    assert first.try_acquire()  # re-entrant for the holder
+    assert not second.try_acquire()
+    first.release()
+    assert second.try_acquire()
+    second.release()
+
+
+def test_drop_partitions_keeps_months_with_unfinished_tasks():
+    from datetime import datetime
+    from types import SimpleNamespace
+    from app.retention import _Archive, drop_partitions_before
+
+    unfinished = {"tasks_p202401": 0, "tasks_p202402": 2}
+
+    class FakeConn:
+        def __init__(self):
+            self.ddl = []
+
+        def exec_driver_sql(self, sql):
+            self.ddl.append(sql)
+
+        def execute(self, statement, params=None):
+            sql = str(statement)
+            if "pg_inherits" in sql:
+                rows = [*unfinished, "tasks_p202403", "tasks_pdefault"]
+            elif "count(*)" in sql:
+                assert params == {"statuses": ["completed", "failed"]}
+                rows = [unfinished[sql.split("FROM ")[1].split()[0]]]
+            else:
+                rows = []
+            return SimpleNamespace(scalars=lambda: iter(rows), scalar=lambda: rows[0])
+
+    conn = FakeConn()
+    dropped = drop_partitions_before(conn, datetime(2024, 3, 1), _Archive(None))
+    assert dropped == ["tasks_p202401"]
+    assert "DROP TABLE tasks_p202401" in conn.ddl
+    assert "DROP TABLE tasks_p202402" not in conn.ddl
+    assert "LOCK TABLE tasks_p202402 IN ACCESS EXCLUSIVE MODE" in conn.ddl
+
+
+def test_partitioned_tasks_ddl_matches_the_model():
+    import re
+    from app.models import Task
+    from app.retention import PARTITIONED_TASKS_DDL
+
+    body = PARTITIONED_TASKS_DDL.split("(", 1)[1].split("PRIMARY KEY", 1)[0]
+    columns = {re.match(r"\s*(\w+)", line).group(1) for line in body.strip().splitlines()}
+    assert columns == {column.name for column in Task.__table__.columns}
+
+
+def test_last_modified_is_withheld_within_the_second_of_the_change():
+    from datetime import datetime, timezone
+    from app.http_cache import cache_headers
+
+    changed = datetime(2025, 9, 1, 12, 0, 0, 400000, tzinfo=timezone.utc)
+    same_second = cache_headers('"e"', changed, False, now=changed.replace(microsecond=900000))
+    assert "Last-Modified" not in same_second
+    later = cache_headers('"e"', changed, False, now=changed.replace(second=1))
+    assert later["Last-Modified"] == "Mon, 01 Sep 2025 12:00:00 GMT"
+
+
+def test_upgrade_schema_quotes_string_server_defaults(tmp_path):
+    from sqlalchemy import create_engine, text
+
+    from app.database import _default_sql, upgrade_schema
+
+    assert _default_sql("normal") == "'normal'"
+    assert _default_sql(text("1")) == "1"
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE tasks (id INTEGER PRIMARY KEY, schedule_time DATETIME NOT NULL, lines VARCHAR NOT NULL, status VARCHAR NOT NULL, result TEXT)")
+        conn.exec_driver_sql("INSERT INTO tasks (id, schedule_time, lines, status) VALUES (1, '2024-01-01 00:00:00', 'victoria', 'scheduled')")
+    upgrade_schema(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT priority FROM tasks WHERE id = 1")).scalar_one() == "normal"